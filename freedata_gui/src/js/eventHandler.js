@@ -93,11 +93,25 @@ export function stateDispatcher(data) {
   }
 }
 
+// scatter data is sent as flat list of x and y values
+function scatterToPoints(scatter) {
+  // older servers are sending a JSON encoded list of points
+  if (typeof scatter === "string") {
+    return JSON.parse(scatter);
+  }
+  const points = [];
+  for (let i = 0; i + 1 < scatter.length; i += 2) {
+    points.push({ x: scatter[i], y: scatter[i + 1] });
+  }
+  return points;
+}
+
 export function eventDispatcher(data) {
-  data = JSON.parse(data);
+  // binary frames are already decoded
+  if (typeof data === "string") data = JSON.parse(data);
 
   if (data.scatter !== undefined) {
-    stateStore.scatter = JSON.parse(data.scatter);
+    stateStore.scatter = scatterToPoints(data.scatter);
     return;
   }
 
@@ -14,6 +14,23 @@ setActivePinia(pinia);
 import { useStateStore } from "../store/stateStore.js";
 const state = useStateStore(pinia);
 
+// binary frames: type (uint8), reserved (uint8), number of values (uint16), values
+const BINARY_FFT = 1; // uint8 dB values
+const BINARY_SCATTER = 2; // int16 x and y values
+
+function decodeBinaryFrame(buffer) {
+  const view = new DataView(buffer);
+  const type = view.getUint8(0);
+  const count = view.getUint16(2, true);
+  switch (type) {
+    case BINARY_FFT:
+      return Array.from(new Uint8Array(buffer, 4, count));
+    case BINARY_SCATTER:
+      return { scatter: Array.from(new Int16Array(buffer, 4, count)) };
+  }
+  return null;
+}
+
 function connect(endpoint, dispatcher) {
   const { protocol, hostname, port } = window.location;
   const wsProtocol = protocol === "https:" ? "wss:" : "ws:";
@@ -21,6 +38,7 @@ function connect(endpoint, dispatcher) {
   const socket = new WebSocket(
     `${wsProtocol}//${hostname}:${adjustedPort}/${endpoint}`,
   );
+  socket.binaryType = "arraybuffer";
 
   // handle opening
   socket.addEventListener("open", function () {
@@ -28,10 +46,23 @@ function connect(endpoint, dispatcher) {
     // when connected again, initially load all data from server
     loadAllData();
     state.modem_connection = "connected";
+    // the server only calculates scatter data, if we have subscribed to it
+    if (endpoint === "events") {
+      socket.send(JSON.stringify({ subscribe: ["scatter"] }));
+    }
+    // fft and scatter data are smaller as binary frames
+    if (endpoint === "events" || endpoint === "fft") {
+      socket.send(JSON.stringify({ encoding: "binary" }));
+    }
   });
 
   // handle data
   socket.addEventListener("message", function (event) {
+    if (event.data instanceof ArrayBuffer) {
+      const data = decodeBinaryFrame(event.data);
+      if (data !== null) dispatcher(data);
+      return;
+    }
     dispatcher(event.data);
   });
 
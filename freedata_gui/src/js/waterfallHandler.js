@@ -20,7 +20,8 @@ export function initWaterfall(id) {
 }
 
 export function addDataToWaterfall(data) {
-  data = JSON.parse(data);
+  // binary frames are already decoded
+  if (typeof data === "string") data = JSON.parse(data);
   if (data.constructor !== Array) return;
   spectrums.forEach((element) => {
     //console.log(element);
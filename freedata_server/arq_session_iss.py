@@ -273,7 +273,7 @@ class ARQSessionISS(arq_session.ARQSession):
             True, self.id, self.dxcall, False, self.state.name, statistics=self.calculate_session_statistics(self.confirmed_bytes, self.total_length))
 
         # clear audio out queue
-        self.modem.audio_out_queue.queue.clear()
+        self.modem.clear_audio_out()
 
         # break actual retries
         self.event_frame_received.set()
@@ -5,7 +5,6 @@ import multiprocessing
 import sounddevice as sd
 import structlog
 import numpy as np
-import queue
 import helpers
 
 log = structlog.get_logger("audio")
@@ -170,205 +169,204 @@ def test_audio_devices(input_id: str, output_id: str) -> list:
     sd._initialize()
     return test_result
 
-def set_audio_volume(datalist: np.ndarray, dB: float) -> np.ndarray:
+def check_samplerate(device_index: int, isInput: bool, samplerate: int) -> bool:
     """
-    Scale values for the provided audio samples by dB.
-
-    :param datalist: Audio samples to scale
-    :type datalist: np.ndarray
-    :param dB: Decibels to scale samples, constrained to the range [-50, 50]
-    :type dB: float
-    :return: Scaled audio samples
-    :rtype: np.ndarray
+    Check if a device can be opened at the given sample rate
+
+    PortAudio accepts the rate as well, if the host api (e.g. ALSA plug devices)
+    is re-sampling for us.
     """
     try:
-        dB = float(dB)
-    except ValueError as e:
-        print(f"[MDM] Changing audio volume failed with error: {e}")
-        dB = 0.0  # 0 dB means no change
-
-    # Clip dB value to the range [-50, 50]
-    dB = np.clip(dB, -30, 20)
-
-    # Ensure datalist is an np.ndarray
-    if not isinstance(datalist, np.ndarray):
-        print("[MDM] Invalid data type for datalist. Expected np.ndarray.")
-        return datalist
-
-    # Convert dB to linear scale
-    scale_factor = 10 ** (dB / 20)
-
-    # Scale samples
-    scaled_data = datalist * scale_factor
-
-    # Clip values to int16 range and convert data type
-    return np.clip(scaled_data, -32768, 32767).astype(np.int16)
-
-
-RMS_COUNTER = 0
-CHANNEL_BUSY_DELAY = 0
-SLOT_DELAY = [0, 0, 0, 0, 0]
+        check_settings = sd.check_input_settings if isInput else sd.check_output_settings
+        check_settings(device=device_index, channels=1, dtype="int16", samplerate=samplerate)
+        return True
+    except (sd.PortAudioError, ValueError) as e:
+        log.debug("[AUD] sample rate not supported", device=device_index, isInput=isInput,
+                  samplerate=samplerate, e=e)
+        return False
 
 
-def prepare_data_for_fft(data, target_length_samples=400):
+class GainStage:
     """
-    Prepare data array for FFT by padding if necessary to match the target length.
-    Center the data if it's shorter than the target length.
+    Fixed point gain for int16 audio blocks
 
-    Parameters:
-    - data: numpy array of np.int16, representing the input data.
-    - target_length_samples: int, the target length of the data in samples.
-
-    Returns:
-    - numpy array of np.int16, padded and/or centered if necessary.
+    The gain factor is calculated once when the level is set. Samples are
+    scaled with an int32 multiply and shift, 0 dB passes the samples through.
     """
-    # Calculate the current length in samples
-    current_length_samples = data.size
-
-    # Check if padding is needed
-    if current_length_samples < target_length_samples:
-        # Calculate total padding needed
-        total_pad_length = target_length_samples - current_length_samples
-        # Calculate padding on each side
-        pad_before = total_pad_length // 2
-        pad_after = total_pad_length - pad_before
-        # Pad the data to center it
-        data_padded = np.pad(data, (pad_before, pad_after), 'constant', constant_values=(0,))
-        return data_padded
-    else:
-        # No padding needed, return original data
-        return data
 
-def calculate_fft(data, fft_queue, states) -> None:
-    """
-    Calculate an average signal strength of the channel to assess
-    whether the channel is "busy."
-    """
-    # Initialize dbfs counter
-    # rms_counter = 0
+    # 12 bits are leaving room for +20 dB on full scale int16 samples within int32
+    SHIFT = 12
 
-    # https://gist.github.com/ZWMiller/53232427efc5088007cab6feee7c6e4c
-    # Fast Fourier Transform, 10*log10(abs) is to scale it to dB
-    # and make sure it's not imaginary
+    def __init__(self, dB: float = 0):
+        self.statistics = {'gain_db': 0, 'clipped_samples': 0}
+        self.set_gain(dB)
 
-    global RMS_COUNTER, CHANNEL_BUSY_DELAY
+    def set_gain(self, dB: float) -> None:
+        try:
+            dB = float(dB)
+        except ValueError as e:
+            log.warning("[AUD] Invalid audio level", dB=dB, e=e)
+            dB = 0.0
+        # range of the audio level settings
+        dB = float(np.clip(dB, -30, 20))
+        self.factor = int(round(10 ** (dB / 20) * (1 << self.SHIFT)))
+        self.unity = self.factor == 1 << self.SHIFT
+        self.statistics['gain_db'] = dB
+
+    def apply(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Scale samples by the gain
+
+        :param samples: Audio samples as np.int16
+        :return: Scaled audio samples, the unchanged input at 0 dB
+        """
+        if self.unity:
+            return samples
+
+        scaled = samples.astype(np.int32)
+        scaled *= self.factor
+        # round to nearest
+        scaled += 1 << (self.SHIFT - 1)
+        scaled >>= self.SHIFT
+
+        if scaled.max() > 32767 or scaled.min() < -32768:
+            self.statistics['clipped_samples'] += int(np.count_nonzero((scaled > 32767) | (scaled < -32768)))
+            np.clip(scaled, -32768, 32767, out=scaled)
+        return scaled.astype(np.int16)
+
+
+class SpectrumEngine:
+    """
+    Spectrum and channel busy detection of the audio stream
 
-    try:
-        data = prepare_data_for_fft(data, target_length_samples=800)
-        fftarray = np.fft.rfft(data)
+    Window, fft buffer and slot boundaries are prepared once. The busy state
+    of all slots is updated with vectorized numpy operations, the waterfall is
+    exponentially averaged and only handed out, after the previous frame has
+    been taken from the fft queue.
+    """
 
+    FFT_LENGTH = 800
+    # bins of the 3200 Hz bandwidth shown in the waterfall
+    WATERFALL_BINS = 315
+    # busy detection slots are derived from the 563 Hz and 1700 Hz wide modes
+    # around the audio center frequency
+    CENTER_FREQUENCY = 1480
+    NARROW_BANDWIDTH = 560
+    WIDE_BANDWIDTH = 1660
+    # signals above the average are highlighted and taken into account for busy detection
+    SIGNAL_THRESHOLD = 15
+    DELAY_INCREMENT = 2
+    MAX_DELAY = 200
+
+    def __init__(self, sample_rate=8000, waterfall_alpha=0.5):
+        self.window = np.hanning(self.FFT_LENGTH).astype(np.float32)
+        # keep the levels of the unwindowed fft
+        self.window *= self.FFT_LENGTH / np.sum(self.window)
+        self.fft_input = np.zeros(self.FFT_LENGTH, dtype=np.float32)
+
+        resolution = sample_rate / self.FFT_LENGTH
+        edges = [
+            0,
+            self.CENTER_FREQUENCY - self.WIDE_BANDWIDTH / 2,
+            self.CENTER_FREQUENCY - self.NARROW_BANDWIDTH / 2,
+            self.CENTER_FREQUENCY + self.NARROW_BANDWIDTH / 2,
+            self.CENTER_FREQUENCY + self.WIDE_BANDWIDTH / 2,
+        ]
+        self.slot_edges = np.array([round(edge / resolution) for edge in edges])
+
+        self.waterfall_alpha = waterfall_alpha
+        self.waterfall = None
+        self.slot_delay = np.zeros(len(self.slot_edges), dtype=np.int32)
+        self.channel_busy_delay = 0
+        self.rms_counter = 0
+
+    def load(self, data) -> None:
+        """
+        Copy the samples centered into the fft buffer, longer blocks are cut to the latest samples
+        """
+        data = data[-self.FFT_LENGTH:]
+        offset = (self.FFT_LENGTH - len(data)) // 2
+        self.fft_input.fill(0)
+        self.fft_input[offset:offset + len(data)] = data
+        self.fft_input *= self.window
+
+    def process(self, data, fft_queue, states) -> None:
+        """
+        Calculate the spectrum of a block of 8 kHz audio and assess
+        whether the channel is "busy."
+        """
+        self.load(data)
+        fftarray = np.abs(np.fft.rfft(self.fft_input))
         # Set value 0 to 1 to avoid division by zero
         fftarray[fftarray == 0] = 1
-        dfft = 10.0 * np.log10(abs(fftarray))
+        dfft = 10.0 * np.log10(fftarray)
 
-        # get average of dfft
+        # Data higher than the average + threshold must be a signal
         avg = np.mean(dfft)
+        signals = dfft > avg + self.SIGNAL_THRESHOLD
 
-        # Detect signals which are higher than the
-        # average + 10 (+10 smoothes the output).
-        # Data higher than the average must be a signal.
-        # Therefore we are setting it to 100 so it will be highlighted
-        # Have to do this when we are not transmitting so our
-        # own sending data will not affect this too much
-        if not states.isTransmitting():
-            dfft[dfft > avg + 15] = 100
-
-            # Calculate audio dbfs
-            # https://stackoverflow.com/a/9763652
-            # calculate dbfs every 50 cycles for reducing CPU load
-            RMS_COUNTER += 1
-            if RMS_COUNTER > 5:
-                d = np.frombuffer(data, np.int16).astype(np.float32)
-                # calculate RMS and then dBFS
-                # https://dsp.stackexchange.com/questions/8785/how-to-compute-dbfs
-                # try except for avoiding runtime errors by division/0
-                try:
-                    rms = int(np.sqrt(np.max(d ** 2)))
-                    if rms == 0:
-                        raise ZeroDivisionError
-                    audio_dbfs = 20 * np.log10(rms / 32768)
-                    states.set("audio_dbfs", audio_dbfs)
-                except Exception as e:
-                    states.set("audio_dbfs", -100)
-
-                RMS_COUNTER = 0
-
-        # Convert data to int to decrease size
-        dfft = dfft.astype(int)
-
-        # Create list of dfft
-        dfftlist = dfft.tolist()
-
-        # Reduce area where the busy detection is enabled
-        # We want to have this in correlation with mode bandwidth
-        # TODO This is not correctly and needs to be checked for correct maths
-        # dfftlist[0:1] = 10,15Hz
-        # Bandwidth[Hz] / 10,15
-        # narrowband = 563Hz = 56
-        # wideband = 1700Hz = 167
-        # 1500Hz = 148
-        # 2700Hz = 266
-        # 3200Hz = 315
-        # Initialize slot delay counters
-        DELAY_INCREMENT = 2
-        MAX_DELAY = 200
-
-        # Main logic
-        slot = 0
-        slot1 = [0, 65]
-        slot2 = [65, 120]
-        slot3 = [120, 176]
-        slot4 = [176, 231]
-        slot5 = [231, len(dfftlist)]
-        slotbusy = [False, False, False, False, False]
-
-        # Set to true if we should increment delay count; else false to decrement
-        addDelay = False
-
-        for range in [slot1, slot2, slot3, slot4, slot5]:
-            range_start = range[0]
-            range_end = range[1]
-            # define the area, we are detecting busy state
-            slotdfft = dfft[range_start:range_end]
-            # Check for signals higher than average by checking for "100"
-            # If we have a signal, increment our channel_busy delay counter
-            # so we have a smoother state toggle
-            if np.sum(slotdfft[slotdfft > avg + 15]) >= 200 and not states.isTransmitting() and not states.is_receiving_codec2_signal():
-                addDelay = True
-                slotbusy[slot] = True
-                SLOT_DELAY[slot] = min(SLOT_DELAY[slot] + DELAY_INCREMENT, MAX_DELAY)
-            else:
-                SLOT_DELAY[slot] = max(SLOT_DELAY[slot] - 1, 0)
-
-                if SLOT_DELAY[slot] == 0:
-                    slotbusy[slot] = False
-                else:
-                    slotbusy[slot] = True
-
-            # increment slot
-            slot += 1
-        states.set_channel_slot_busy(slotbusy)
-
-        if addDelay:
-            # Limit delay counter to a maximum of 200. The higher this value,
-            # the longer we will wait until releasing state
+        transmitting = states.isTransmitting()
+        if not transmitting:
+            self.update_audio_dbfs(data, states)
+        self.update_channel_busy(signals, transmitting, states)
+
+        if self.waterfall is None:
+            self.waterfall = dfft
+        else:
+            self.waterfall += self.waterfall_alpha * (dfft - self.waterfall)
+        # the mailbox replaces a frame which hasn't been sent yet
+        frame = self.waterfall[:self.WATERFALL_BINS].astype(int)
+        # highlight signals, but not our own while transmitting
+        if not transmitting:
+            frame[signals[:self.WATERFALL_BINS]] = 100
+        fft_queue.put(frame.tolist())
+
+    def update_audio_dbfs(self, data, states) -> None:
+        # calculate dbfs every 6 cycles for reducing CPU load
+        self.rms_counter += 1
+        if self.rms_counter <= 5:
+            return
+        self.rms_counter = 0
+        # https://dsp.stackexchange.com/questions/8785/how-to-compute-dbfs
+        peak = int(np.max(np.abs(np.asarray(data, dtype=np.int32)))) if len(data) else 0
+        if peak == 0:
+            states.set("audio_dbfs", -100)
+        else:
+            states.set("audio_dbfs", 20 * np.log10(peak / 32768))
+
+    def update_channel_busy(self, signals, transmitting, states) -> None:
+        # more than one signal bin per slot
+        busy = np.add.reduceat(signals, self.slot_edges) >= 2
+        if transmitting or states.is_receiving_codec2_signal():
+            busy[:] = False
+
+        # delay counters are making the state toggle smoother
+        self.slot_delay = np.where(
+            busy,
+            np.minimum(self.slot_delay + self.DELAY_INCREMENT, self.MAX_DELAY),
+            np.maximum(self.slot_delay - 1, 0),
+        )
+        states.set_channel_slot_busy((busy | (self.slot_delay > 0)).tolist())
+
+        if busy.any():
             states.set_channel_busy_condition_traffic(True)
-            CHANNEL_BUSY_DELAY = min(CHANNEL_BUSY_DELAY + DELAY_INCREMENT, MAX_DELAY)
+            self.channel_busy_delay = min(self.channel_busy_delay + self.DELAY_INCREMENT, self.MAX_DELAY)
         else:
-            # Decrement channel busy counter if no signal has been detected.
-            CHANNEL_BUSY_DELAY = max(CHANNEL_BUSY_DELAY - 1, 0)
             # When our channel busy counter reaches 0, toggle state to False
-            if CHANNEL_BUSY_DELAY == 0:
+            self.channel_busy_delay = max(self.channel_busy_delay - 1, 0)
+            if self.channel_busy_delay == 0:
                 states.set_channel_busy_condition_traffic(False)
 
-        # erase queue if greater than 3
-        if fft_queue.qsize() >= 1:
-            fft_queue = queue.Queue()
 
-        fft_queue.put(dfftlist[:315])  # 315 --> bandwidth 3200
+SPECTRUM_ENGINE = SpectrumEngine()
+
 
+def calculate_fft(data, fft_queue, states) -> None:
+    try:
+        SPECTRUM_ENGINE.process(data, fft_queue, states)
     except Exception as err:
-        print(f"[MDM] calculate_fft: Exception: {err}")
+        log.warning("[MDM] calculate_fft", e=err)
+
 
 def terminate():
     log.warning("[SHUTDOWN] terminating audio instance...")
@@ -12,8 +12,10 @@ import hashlib
 import glob
 import os
 import sys
+import time
 from enum import Enum
 from threading import Lock
+from multiprocessing import shared_memory
 import codec2_filter_coeff
 import numpy as np
 import structlog
@@ -130,6 +132,9 @@ api.freedv_set_sync.restype = ctypes.c_void_p
 api.freedv_open_advanced.argtype = [ctypes.c_int, ctypes.c_void_p]  # type: ignore
 api.freedv_open_advanced.restype = ctypes.c_void_p
 
+api.freedv_close.argtypes = [ctypes.c_void_p]  # type: ignore
+api.freedv_close.restype = None
+
 api.freedv_get_bits_per_modem_frame.argtype = [ctypes.c_void_p]  # type: ignore
 api.freedv_get_bits_per_modem_frame.restype = ctypes.c_int
 
@@ -216,6 +221,43 @@ class MODEMSTATS(ctypes.Structure):
     ]
 
 
+def read_modem_stats(freedv: ctypes.c_void_p, modem_stats: MODEMSTATS) -> dict:
+    """
+    Fetch the extended modem stats of the last frame into modem_stats
+
+    :param freedv: codec2 instance to query
+    :type freedv: ctypes.c_void_p
+    :param modem_stats: preallocated stats struct, which is overwritten
+    :type modem_stats: MODEMSTATS
+    :return: snr, (audio) frequency offset in Hz, sync and clock offset
+    :rtype: dict
+    """
+    api.freedv_get_modem_extended_stats(freedv, ctypes.byref(modem_stats))
+    return {
+        "snr": int(round(modem_stats.snr_est, 1)),
+        "frequency_offset": round(modem_stats.foff) * (-1),
+        "sync": modem_stats.sync,
+        "clock_offset": modem_stats.clock_offset,
+    }
+
+
+def get_scatter_points(modem_stats: MODEMSTATS) -> np.ndarray:
+    """
+    Extract the constellation points of the received symbols
+
+    :param modem_stats: extended modem stats of the last frame
+    :type modem_stats: MODEMSTATS
+    :return: array of (x, y) points, scaled down by 1000, without points on the axes
+    :rtype: np.ndarray
+    """
+    # rx_symbols holds real and imaginary part of each symbol next to each other
+    symbols = np.ctypeslib.as_array(modem_stats.rx_symbols)
+    x = symbols[:, 0::2] // 1000
+    y = symbols[:, 1::2] // 1000
+    valid = (x != 0) & (y != 0)
+    return np.column_stack((x[valid], y[valid])).astype(int)
+
+
 # Return code flags for freedv_get_rx_status() function
 api.FREEDV_RX_TRIAL_SYNC = 0x1  # type: ignore # demodulator has trial sync
 api.FREEDV_RX_SYNC = 0x2  # type: ignore # demodulator has sync
@@ -292,6 +334,231 @@ class audio_buffer:
         self.mutex.release()
 
 
+class ring_buffer:
+    """
+    Lock-free single-producer/single-consumer audio buffer with the same
+    push/pop/nbuffer interface as audio_buffer.
+
+    Every sample is stored twice in a mirrored array of 2 * size samples, so
+    the unread samples are always available as one contiguous view for
+    freedv_rawdatarx and pop only needs to move the read position.
+    """
+
+    def __init__(self, size):
+        log.debug("[C2 ] Creating ring buffer", size=size)
+        self.size = size
+        self.mirror = np.zeros(2 * size, dtype=np.int16)
+        # total number of samples written and read. The write counter is only
+        # changed by the producer, the read counter only by the consumer
+        self.write_count = 0
+        self.read_count = 0
+
+    @property
+    def nbuffer(self):
+        """Number of samples available for reading"""
+        return self.write_count - self.read_count
+
+    @property
+    def buffer(self):
+        """Contiguous view, starting with the oldest unread sample"""
+        start = self.read_count % self.size
+        return self.mirror[start : start + self.size]
+
+    def push(self, samples):
+        """
+        Push new data to buffer
+
+        Args:
+            samples:
+
+        Returns:
+            Nothing
+        """
+        assert self.nbuffer + len(samples) <= self.size
+        self.write(samples)
+
+    def write(self, samples):
+        """
+        Write samples to both halves of the mirrored array and publish them
+        """
+        length = len(samples)
+        start = self.write_count % self.size
+        end = start + length
+        # samples behind the end of the first half are the mirror of the wrapped part
+        self.mirror[start:end] = samples
+        # write the other copy of each sample
+        split = min(end, self.size) - start
+        self.mirror[start + self.size : start + self.size + split] = samples[:split]
+        if end > self.size:
+            self.mirror[: end - self.size] = samples[split:]
+
+        # publish samples only after they have been written
+        self.write_count += length
+
+    def pop(self, size):
+        """
+        get data from buffer in size of NIN
+        Args:
+          size:
+
+        Returns:
+            Nothing
+        """
+        assert size <= self.nbuffer
+        self.read_count += size
+
+    def latest(self, size):
+        """
+        Contiguous view on the most recently written samples, regardless of
+        the read position. Only valid until the next write.
+        """
+        size = min(size, self.size, self.write_count)
+        start = (self.write_count - size) % self.size
+        return self.mirror[start : start + size]
+
+
+class shared_ring_buffer(ring_buffer):
+    """
+    RX sample history which is written once and read by several decoders.
+
+    The writer never blocks. Each decoder consumes the history from its own
+    ring_buffer_reader cursor, so a block of samples is only stored once,
+    regardless of the number of decoders.
+    """
+
+    def push(self, samples):
+        """
+        Push new data to the history, overwriting the oldest samples
+
+        Args:
+            samples:
+
+        Returns:
+            Nothing
+        """
+        assert len(samples) <= self.size
+        self.write(samples)
+
+    def reader(self, max_lag):
+        """
+        Create a read cursor, starting at the current write position
+
+        Args:
+            max_lag: number of samples a reader may fall behind the writer
+
+        Returns:
+            ring_buffer_reader
+        """
+        # keep some headroom, so the writer is not overwriting samples
+        # a decoder is currently working on
+        assert max_lag < self.size
+        return ring_buffer_reader(self, max_lag)
+
+
+class ring_buffer_reader:
+    """
+    Read cursor on a shared_ring_buffer with the pop/nbuffer/buffer interface
+    of audio_buffer. Only the owning decoder thread moves the cursor.
+    """
+
+    def __init__(self, ring, max_lag):
+        self.ring = ring
+        self.size = max_lag
+        self.read_count = ring.write_count
+        self.overflows = 0
+
+    @property
+    def nbuffer(self):
+        """Number of samples the reader is behind the writer"""
+        return self.ring.write_count - self.read_count
+
+    @property
+    def buffer(self):
+        """Contiguous view, starting with the oldest unread sample"""
+        start = self.read_count % self.ring.size
+        return self.ring.mirror[start : start + self.ring.size]
+
+    def pop(self, size):
+        """
+        get data from buffer in size of NIN, skips ahead if the writer has
+        lapped the reader meanwhile
+        Args:
+          size:
+
+        Returns:
+            Nothing
+        """
+        assert size <= self.nbuffer
+        self.read_count += size
+        self.check_overflow()
+
+    def sync(self):
+        """
+        Skip all unread samples and continue at the current write position
+        """
+        self.read_count = self.ring.write_count
+
+    def check_overflow(self) -> bool:
+        """
+        Skip the oldest samples if the reader has fallen too far behind the writer
+
+        Returns:
+            True if samples have been skipped
+        """
+        if self.nbuffer <= self.size:
+            return False
+        self.read_count = self.ring.write_count - self.size // 2
+        self.overflows += 1
+        return True
+
+
+class shared_memory_ring_buffer(shared_ring_buffer):
+    """
+    shared_ring_buffer placed in shared memory, so decoder processes can read
+    the RX history written by the main process. The write counter is kept in
+    the shared memory header.
+    """
+
+    HEADER_SIZE = 8
+
+    def __init__(self, size, name=None):
+        create = name is None
+        log.debug("[C2 ] Creating shared memory ring buffer", size=size, create=create)
+        self.size = size
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=create, size=self.HEADER_SIZE + 2 * size * np.dtype(np.int16).itemsize
+        )
+        self.counter = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self.mirror = np.ndarray((2 * size,), dtype=np.int16, buffer=self.shm.buf, offset=self.HEADER_SIZE)
+        if create:
+            self.counter[0] = 0
+            self.mirror.fill(0)
+        self.read_count = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def write_count(self):
+        return int(self.counter[0])
+
+    @write_count.setter
+    def write_count(self, value):
+        self.counter[0] = value
+
+    def close(self, unlink=False):
+        """
+        Detach from shared memory, the owner should unlink it
+        """
+        # numpy views are holding references to the shared memory buffer
+        del self.counter
+        del self.mirror
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
 # Resampler ---------------------------------------------------------
 
 # Oversampling rate
@@ -376,6 +643,93 @@ class resampler:
         return out48
 
 
+class streaming_resampler:
+    """
+    48<->8 kHz re-sampler for continuous streams
+
+    Working buffers are allocated once for blocks of up to max_samples_48
+    samples at 48 kHz and grown if a larger block arrives. The filter memory
+    is carried over from block to block, so each stream direction needs its
+    own streaming_resampler.
+    """
+
+    MEM8 = api.FDMDV_OS_TAPS_48_8K
+    MEM48 = api.FDMDV_OS_TAPS_48K
+
+    def __init__(self, max_samples_48=4800):
+        log.debug("[C2 ] Create streaming 48<->8 kHz resampler", max_samples_48=max_samples_48)
+        self.in48_mem = np.zeros(self.MEM48 + max_samples_48, dtype=np.int16)
+        self.in8_mem = np.zeros(self.MEM8 + max_samples_48 // api.FDMDV_OS_48, dtype=np.int16)  # type: ignore
+
+    def resample48_to_8(self, in48, out8=None):
+        """
+        Downsample audio from 48000Hz to 8000Hz
+        Args:
+            in48: input data as np.int16, length must be a multiple of 6
+            out8: optional np.int16 array of len(in48) / 6 samples for the result
+
+        Returns:
+            Downsampled 8000Hz data as np.int16, out8 if given
+        """
+        assert in48.dtype == np.int16
+        # Length of input vector must be an integer multiple of api.FDMDV_OS_48
+        assert len(in48) % api.FDMDV_OS_48 == 0  # type: ignore
+
+        n48 = len(in48)
+        n8 = n48 // api.FDMDV_OS_48  # type: ignore
+        if self.MEM48 + n48 > len(self.in48_mem):
+            self.in48_mem = np.concatenate((self.in48_mem[: self.MEM48], np.zeros(n48, dtype=np.int16)))
+        if out8 is None:
+            out8 = np.empty(n8, dtype=np.int16)
+        assert out8.dtype == np.int16 and len(out8) == n8 and out8.flags.c_contiguous
+
+        # filter memory is kept in front of the new samples
+        self.in48_mem[self.MEM48 : self.MEM48 + n48] = in48
+        # In C: pin48=&in48_mem[MEM48]
+        pin48 = ctypes.c_void_p(self.in48_mem.ctypes.data + 2 * self.MEM48)
+        api.fdmdv_48_to_8_short(out8.ctypes, pin48, n8)  # type: ignore
+
+        # the last samples are the filter memory of the next block
+        self.in48_mem[: self.MEM48] = self.in48_mem[n48 : n48 + self.MEM48]
+        return out8
+
+    def resample8_to_48(self, in8, out48=None):
+        """
+        Re-sample audio from 8000Hz to 48000Hz
+        Args:
+            in8: input data as np.int16
+            out48: optional np.int16 array of len(in8) * 6 samples for the result
+
+        Returns:
+            48000Hz audio as np.int16, out48 if given
+        """
+        assert in8.dtype == np.int16
+
+        n8 = len(in8)
+        if self.MEM8 + n8 > len(self.in8_mem):
+            self.in8_mem = np.concatenate((self.in8_mem[: self.MEM8], np.zeros(n8, dtype=np.int16)))
+        if out48 is None:
+            out48 = np.empty(api.FDMDV_OS_48 * n8, dtype=np.int16)  # type: ignore
+        assert out48.dtype == np.int16 and len(out48) == api.FDMDV_OS_48 * n8 and out48.flags.c_contiguous  # type: ignore
+
+        self.in8_mem[self.MEM8 : self.MEM8 + n8] = in8
+        # In C: pin8=&in8_mem[MEM8]
+        pin8 = ctypes.c_void_p(self.in8_mem.ctypes.data + 2 * self.MEM8)
+        api.fdmdv_8_to_48_short(out48.ctypes, pin8, n8)  # type: ignore
+
+        self.in8_mem[: self.MEM8] = self.in8_mem[n8 : n8 + self.MEM8]
+        return out48
+
+    def set_history8(self, in8):
+        """
+        Continue resample8_to_48 as if in8 had been the last input,
+        only its last MEM8 samples are relevant
+        """
+        in8 = in8[-self.MEM8:]
+        self.in8_mem[: self.MEM8 - len(in8)] = 0
+        self.in8_mem[self.MEM8 - len(in8) : self.MEM8] = in8
+
+
 def open_instance(mode: int) -> ctypes.c_void_p:
     data_custom = 21
     if mode in [FREEDV_MODE.data_ofdm_500.value, FREEDV_MODE.data_ofdm_2438.value]:
@@ -402,10 +756,188 @@ def get_bytes_per_frame(mode: int) -> int:
     :return: Bytes per frame of the supplied codec2 data mode
     :rtype: int
     """
-    freedv = open_instance(mode)
-    # TODO add close session
-    # get number of bytes per frame for mode
-    return int(api.freedv_get_bits_per_modem_frame(freedv) / 8)
+    return mode_geometry(mode)["bytes_per_frame"]
+
+
+def read_geometry(freedv: ctypes.c_void_p) -> dict:
+    """
+    Read frame size and sample counts of an open codec2 instance
+
+    :param freedv: codec2 instance to query
+    :type freedv: ctypes.c_void_p
+    :return: Frame geometry of the instance
+    :rtype: dict
+    """
+    bits_per_frame = api.freedv_get_bits_per_modem_frame(freedv)
+    n_tx_preamble_modem_samples = api.freedv_get_n_tx_preamble_modem_samples(freedv)
+    n_tx_modem_samples = api.freedv_get_n_tx_modem_samples(freedv)
+    n_tx_postamble_modem_samples = api.freedv_get_n_tx_postamble_modem_samples(freedv)
+    return {
+        "bits_per_frame": bits_per_frame,
+        "bytes_per_frame": int(bits_per_frame / 8),
+        # 2 bytes CRC16
+        "payload_bytes_per_frame": int(bits_per_frame / 8) - 2,
+        "n_tx_modem_samples": n_tx_modem_samples,
+        "n_tx_preamble_modem_samples": n_tx_preamble_modem_samples,
+        "n_tx_postamble_modem_samples": n_tx_postamble_modem_samples,
+        "n_max_modem_samples": api.freedv_get_n_max_modem_samples(freedv),
+        # on air duration of a frame with preamble and postamble in seconds
+        "duration": (n_tx_preamble_modem_samples + n_tx_modem_samples + n_tx_postamble_modem_samples)
+        / api.FREEDV_FS_8000,
+    }
+
+
+MODE_GEOMETRY = {}
+
+
+def mode_geometry(mode: int) -> dict:
+    """
+    Provide the frame geometry of a mode, read once from codec2 and cached
+
+    :param mode: Codec2 mode to query
+    :type mode: int
+    :return: Frame geometry of the mode, see read_geometry
+    :rtype: dict
+    """
+    if mode not in MODE_GEOMETRY:
+        freedv = instances.get(mode)
+        try:
+            MODE_GEOMETRY[mode] = read_geometry(freedv)
+        finally:
+            instances.release(mode)
+    return MODE_GEOMETRY[mode]
+
+
+def estimate_instance_memory(geometry: dict) -> int:
+    """
+    Rough size of the sample buffers of an instance in bytes
+
+    codec2 doesn't report its allocations, so this is taken from the buffer
+    sizes of the mode, as complex float samples. Tables and filter states are
+    not included. Only used for the statistics, never for closing instances.
+    """
+    samples = (
+        geometry["n_max_modem_samples"]
+        + geometry["n_tx_preamble_modem_samples"]
+        + geometry["n_tx_modem_samples"]
+        + geometry["n_tx_postamble_modem_samples"]
+    )
+    return samples * 2 * ctypes.sizeof(ctypes.c_float)
+
+
+class instance_manager:
+    """
+    Codec2 instances, opened on first use and shared per mode and role.
+
+    Users are taking an instance with get() and hand it back with release().
+    Instances without users are closed by close_idle(), after they haven't
+    been used for a while, and are opened again on their next use.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.instances = {}
+        # updated in place, so it can be published with the modem state
+        self.statistics = {
+            'instances': 0,
+            'opened': 0,
+            'closed': 0,
+            'memory_estimate': 0,
+        }
+
+    def get(self, mode: int, role: str = "tx") -> ctypes.c_void_p:
+        """
+        Get the instance of a mode, open it if needed
+
+        Args:
+            mode: codec2 mode value
+            role: "tx" or "rx", each role has its own instance state
+
+        Returns:
+            codec2 instance
+        """
+        with self.lock:
+            entry = self.instances.get((mode, role))
+            if entry is None:
+                instance = open_instance(mode)
+                entry = {
+                    'instance': instance,
+                    'users': 0,
+                    'last_used': time.time(),
+                    'memory_estimate': estimate_instance_memory(read_geometry(instance)),
+                }
+                self.instances[(mode, role)] = entry
+                self.statistics['opened'] += 1
+                self.update_statistics()
+                log.debug("[C2 ] Opened codec2 instance", mode=mode, role=role,
+                          memory_estimate=entry['memory_estimate'])
+
+            entry['users'] += 1
+            entry['last_used'] = time.time()
+            return entry['instance']
+
+    def release(self, mode: int, role: str = "tx") -> None:
+        """
+        Hand back an instance taken with get()
+        """
+        with self.lock:
+            entry = self.instances[(mode, role)]
+            entry['users'] -= 1
+            entry['last_used'] = time.time()
+
+    def apply(self, role: str, function) -> None:
+        """
+        Call function for every open instance of a role
+        """
+        with self.lock:
+            for (mode, instance_role), entry in self.instances.items():
+                if instance_role == role:
+                    function(entry['instance'])
+
+    def close_idle(self, idle_timeout: float) -> int:
+        """
+        Close instances without users, which have been idle for idle_timeout seconds
+
+        Args:
+            idle_timeout: idle time in seconds, 0 keeps all instances open
+
+        Returns:
+            number of closed instances
+        """
+        if idle_timeout <= 0:
+            return 0
+
+        closed = 0
+        now = time.time()
+        with self.lock:
+            for key, entry in list(self.instances.items()):
+                if entry['users'] == 0 and now - entry['last_used'] >= idle_timeout:
+                    api.freedv_close(entry['instance'])
+                    del self.instances[key]
+                    closed += 1
+                    log.debug("[C2 ] Closed idle codec2 instance", mode=key[0], role=key[1])
+            self.statistics['closed'] += closed
+            self.update_statistics()
+        return closed
+
+    def close_unused(self, mode: int) -> None:
+        """
+        Close the instances of a mode without users, so they are opened with a new configuration
+        """
+        with self.lock:
+            for key, entry in list(self.instances.items()):
+                if key[0] == mode and entry['users'] == 0:
+                    api.freedv_close(entry['instance'])
+                    del self.instances[key]
+                    self.statistics['closed'] += 1
+            self.update_statistics()
+
+    def update_statistics(self) -> None:
+        self.statistics['instances'] = len(self.instances)
+        self.statistics['memory_estimate'] = sum(entry['memory_estimate'] for entry in self.instances.values())
+
+
+instances = instance_manager()
 
 
 MAX_UW_BITS = 64#192
@@ -644,3 +1176,20 @@ ofdm_configurations = {
     #FREEDV_MODE.data_qam_2438.value: data_qam_2438_config
 
 }
+
+# incremented on every change of an OFDM configuration, for invalidating caches of modulated waveforms
+ofdm_configuration_generation = 0
+
+
+def set_ofdm_configuration(mode: int, config: FREEDV_ADVANCED) -> None:
+    """
+    Replace the OFDM configuration of a custom mode
+
+    Cached geometry and unused instances of the mode are dropped, instances
+    currently in use are keeping the old configuration until they are closed.
+    """
+    global ofdm_configuration_generation
+    ofdm_configurations[mode] = config
+    MODE_GEOMETRY.pop(mode, None)
+    instances.close_unused(mode)
+    ofdm_configuration_generation += 1
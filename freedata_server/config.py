@@ -30,6 +30,8 @@ class CONFIG:
             'output_device': str,
             'rx_audio_level': int,
             'tx_audio_level': int,
+            'native_samplerate': bool,
+            'latency_profile': str,
         },
         'RADIO': {
             'control': str,
@@ -66,6 +68,12 @@ class CONFIG:
             'maximum_bandwidth': int,
             'tx_delay': int,
             'enable_socket_interface': bool,
+            'demodulator_processes': int,
+            'codec2_instance_idle_timeout': int,
+            'demodulator_decode_budget': int,
+            'scatter_on_demand': bool,
+            'fft_max_rate': int,
+            'tx_burst_cache_mb': int,
         },
         'SOCKET_INTERFACE': {
             'enable' : bool,
@@ -81,6 +89,8 @@ class CONFIG:
         },
         'GUI':{
             'auto_run_browser': bool,
+            'event_queue_size': int,
+            'event_retention': list,
         }
     }
 
@@ -91,6 +101,19 @@ class CONFIG:
         str: '',
     }
 
+    # defaults of settings where the type default doesn't work, so config
+    # files written before a setting existed get a useful value
+    setting_defaults = {
+        'MODEM': {
+            'codec2_instance_idle_timeout': 60,
+            'fft_max_rate': 10,
+            'tx_burst_cache_mb': 16,
+        },
+        'GUI': {
+            'event_queue_size': 256,
+        },
+    }
+
     def __init__(self, configfile: str):
 
         # set up logger
@@ -157,7 +180,8 @@ class CONFIG:
                 self.log.info(f"[CFG] Adding missing section: {section}")
             for setting, value_type in settings.items():
                 if not self.parser.has_option(section, setting):
-                    default_value = self.default_values.get(value_type, None)
+                    default_value = self.setting_defaults.get(section, {}).get(
+                        setting, self.default_values.get(value_type, None))
 
                     self.parser.set(section, setting, str(default_value))
                     self.log.info(f"[CFG] Adding missing setting: {section}.{setting}")
@@ -302,16 +302,15 @@ class DataFrameFactory:
 
 
             else:
-                extracted_data[key] = data
+                # frames might be views on reused buffers, so keep a copy
+                extracted_data[key] = bytes(data)
 
             buffer_position += item_length
 
         return extracted_data
 
     def get_bytes_per_frame(self, mode: codec2.FREEDV_MODE) -> int:
-        freedv = codec2.open_instance(mode.value)
-        bytes_per_frame = int(codec2.api.freedv_get_bits_per_modem_frame(freedv) / 8)
-        return bytes_per_frame
+        return codec2.get_bytes_per_frame(mode.value)
     
     def get_available_data_payload_for_mode(self, type: FR_TYPE, mode:codec2.FREEDV_MODE):
         whole_frame_length = self.get_bytes_per_frame(mode)
@@ -386,7 +385,7 @@ class DataFrameFactory:
 
     def build_fec(self, mode, payload):
         mode_int = codec2.freedv_get_mode_value_by_name(mode)
-        payload_per_frame = codec2.get_bytes_per_frame(mode_int) - 2
+        payload_per_frame = codec2.mode_geometry(mode_int)["payload_bytes_per_frame"]
         fec_payload_length = payload_per_frame - 1
         fec_frame = bytearray(payload_per_frame)
         fec_frame[:1] = bytes([FR_TYPE.FEC.value])
@@ -3,8 +3,12 @@ import codec2
 import ctypes
 import structlog
 import threading
+import time
 import audio
-import itertools
+import helpers
+import queue
+import demodulator_worker
+import frame_buffer
 
 TESTMODE = False
 
@@ -16,13 +20,17 @@ class Demodulator():
             MODE_DICT[mode.value] = {
                 'decode': False,
                 'bytes_per_frame': None,
-                'bytes_out': None,
+                'frame_pool': None,
                 'audio_buffer': None,
                 'nin': None,
                 'instance': None,
                 'state_buffer': [],
                 'name': mode.name.upper(),
-                'decoding_thread': None
+                'decoding_thread': None,
+                'condition': None,
+                'wakeups': 0,
+                'parked': True,
+                'modem_stats': None,
             }
 
     def __init__(self, config, audio_rx_q, data_q_rx, states, event_manager, service_queue, fft_queue):
@@ -32,8 +40,9 @@ class Demodulator():
         self.shutdown_flag = threading.Event()
 
         self.service_queue = service_queue
-        self.AUDIO_FRAMES_PER_BUFFER_RX = 4800
-        self.buffer_overflow_counter = [0] * len(codec2.FREEDV_MODE)
+        # the latency profile limits how far a decoder may fall behind the rx stream
+        self.latency_profile, latency_settings = helpers.get_latency_profile(config)
+        self.AUDIO_FRAMES_PER_BUFFER_RX = codec2.api.FREEDV_FS_8000 * latency_settings['rx_buffer_ms'] // 1000
         self.is_codec2_traffic_counter = 0
         self.is_codec2_traffic_cooldown = 5
 
@@ -45,6 +54,30 @@ class Demodulator():
 
         self.fft_queue = fft_queue
 
+        # decoder counters per mode, published with the full modem state
+        self.decoder_statistics = {}
+        self.states.register_modem_statistics("decoder", self.decoder_statistics)
+        self.states.register_modem_statistics("codec2_instances", codec2.instances.statistics)
+
+        # decoders are running in threads, or in worker processes if configured
+        self.demodulator_processes = config['MODEM'].get('demodulator_processes', 0)
+        self.process_pool = None
+        # maximum number of nin blocks decoded per wakeup, 0 drains the buffer
+        self.decode_budget = config['MODEM'].get('demodulator_decode_budget', 0)
+        # only calculate scatter data, if a client has subscribed to it
+        self.scatter_on_demand = config['MODEM'].get('scatter_on_demand', False)
+        self.codec2_traffic_workers = {}
+
+        # RX samples are stored once and consumed by every decoder from its own read cursor
+        if self.demodulator_processes > 0:
+            self.rx_history = codec2.shared_memory_ring_buffer(2 * self.AUDIO_FRAMES_PER_BUFFER_RX)
+            self.process_pool = demodulator_worker.DemodulatorProcessPool(
+                self.MODE_DICT, self.demodulator_processes, self.rx_history, self.AUDIO_FRAMES_PER_BUFFER_RX,
+                self.decode_budget
+            )
+        else:
+            self.rx_history = codec2.shared_ring_buffer(2 * self.AUDIO_FRAMES_PER_BUFFER_RX)
+
         # Audio Stream object
         self.stream = None
 
@@ -60,7 +93,17 @@ class Demodulator():
 
 
     def init_codec2(self):
-        # Open codec2 instances
+        for mode in self.MODE_DICT:
+            self.decoder_statistics[self.MODE_DICT[mode]["name"]] = {
+                'wakeups': 0,
+                'lag': 0,
+                'overflows': 0,
+                'backlog_ms': 0,
+            }
+        # worker processes are opening their own codec2 instances
+        if self.process_pool:
+            return
+        # codec2 instances are opened when a mode gets enabled
         for mode in codec2.FREEDV_MODE:
             self.init_codec2_mode(mode.value)
 
@@ -76,53 +119,58 @@ class Demodulator():
 
     def init_codec2_mode(self, mode):
         """
-        Init codec2 and return some important parameters
+        Init the decoder state of a mode
         """
 
-        # create codec2 instance
-        #c2instance = ctypes.cast(
-        c2instance = codec2.open_instance(mode)
+        # init read cursor on the shared rx history
+        audio_buffer = self.rx_history.reader(self.AUDIO_FRAMES_PER_BUFFER_RX)
+
+        self.MODE_DICT[mode]["instance"] = None
+        self.MODE_DICT[mode]["audio_buffer"] = audio_buffer
+        self.MODE_DICT[mode]["parked"] = True
+        # reused for every decoded frame, the struct is quite large
+        self.MODE_DICT[mode]["modem_stats"] = codec2.MODEMSTATS()
+        # decoder threads are parked on this condition until enough samples are available
+        self.MODE_DICT[mode]["condition"] = threading.Condition()
+        self.MODE_DICT[mode]["wakeups"] = 0
+
+    def open_decoder(self, mode):
+        """
+        Take the codec2 rx instance of a mode and init its parameters
+        """
+        c2instance = codec2.instances.get(mode, "rx")
 
         # get bytes per frame
-        bytes_per_frame = int(
-            codec2.api.freedv_get_bits_per_modem_frame(c2instance) / 8
-        )
-        # create byte out buffer
-        bytes_out = ctypes.create_string_buffer(bytes_per_frame)
+        bytes_per_frame = codec2.mode_geometry(mode)["bytes_per_frame"]
 
         # set initial frames per burst
         codec2.api.freedv_set_frames_per_burst(c2instance, 1)
 
-        # init audio buffer
-        audio_buffer = codec2.audio_buffer(2 * self.AUDIO_FRAMES_PER_BUFFER_RX)
-
-        # get initial nin
-        nin = codec2.api.freedv_nin(c2instance)
-
-        # Additional Datac0-specific information - these are not referenced anywhere else.
-        # self.signalling_datac0_payload_per_frame = self.signalling_datac0_bytes_per_frame - 2
-        # self.signalling_datac0_n_nom_modem_samples = codec2.api.freedv_get_n_nom_modem_samples(
-        #     self.signalling_datac0_freedv
-        # )
-        # self.signalling_datac0_n_tx_modem_samples = codec2.api.freedv_get_n_tx_modem_samples(
-        #     self.signalling_datac0_freedv
-        # )
-        # self.signalling_datac0_n_tx_preamble_modem_samples = (
-        #     codec2.api.freedv_get_n_tx_preamble_modem_samples(self.signalling_datac0_freedv)
-        # )
-        # self.signalling_datac0_n_tx_postamble_modem_samples = (
-        #     codec2.api.freedv_get_n_tx_postamble_modem_samples(self.signalling_datac0_freedv)
-        # )
-
         self.MODE_DICT[mode]["instance"] = c2instance
         self.MODE_DICT[mode]["bytes_per_frame"] = bytes_per_frame
-        self.MODE_DICT[mode]["bytes_out"] = bytes_out
-        self.MODE_DICT[mode]["audio_buffer"] = audio_buffer
-        self.MODE_DICT[mode]["nin"] = nin
+        # decoded frames are written to pooled buffers
+        if self.MODE_DICT[mode]["frame_pool"] is None or self.MODE_DICT[mode]["frame_pool"].size != bytes_per_frame:
+            self.MODE_DICT[mode]["frame_pool"] = frame_buffer.FrameBufferPool(bytes_per_frame)
+        self.MODE_DICT[mode]["nin"] = codec2.api.freedv_nin(c2instance)
+
+    def close_decoder(self, mode):
+        """
+        Hand back the codec2 rx instance of a mode, it is closed after being idle
+        """
+        self.MODE_DICT[mode]["instance"] = None
+        codec2.instances.release(mode, "rx")
 
     def start(self, stream):
         self.stream = stream
 
+        if self.process_pool:
+            self.update_process_pool()
+            self.process_pool.start()
+            threading.Thread(
+                target=self.collect_worker_results, name="DEMODULATOR WORKER RESULTS", daemon=True
+            ).start()
+            return
+
         for mode in self.MODE_DICT:
             # Start decoder threads
             self.MODE_DICT[mode]['decoding_thread'] = threading.Thread(
@@ -130,87 +178,151 @@ class Demodulator():
             )
             self.MODE_DICT[mode]['decoding_thread'].start()
 
-    def get_frequency_offset(self, freedv: ctypes.c_void_p) -> float:
+    def is_decodable(self, mode) -> bool:
+        """
+        Check if a mode is enabled and has at least nin samples buffered
+        """
+        mode_data = self.MODE_DICT[mode]
+        return mode_data["decode"] and not mode_data["parked"] and mode_data["audio_buffer"].nbuffer >= mode_data["nin"]
+
+    def push_audio(self, audio_8k) -> None:
+        """
+        Push 8 kHz audio to the shared rx history and wake up
+        decoder threads which have enough samples for decoding.
         """
-        Ask codec2 for the calculated (audio) frequency offset of the received signal.
+        if self.shutdown_flag.is_set():
+            return
+        self.rx_history.push(audio_8k)
+        if self.process_pool:
+            self.process_pool.notify()
+            return
+        for mode in self.MODE_DICT:
+            mode_data = self.MODE_DICT[mode]
+            if mode_data['audio_buffer'] and self.is_decodable(mode):
+                with mode_data['condition']:
+                    mode_data['condition'].notify()
 
-        :param freedv: codec2 instance to query
-        :type freedv: ctypes.c_void_p
-        :return: Offset of audio frequency in Hz
-        :rtype: float
+    def wait_for_audio(self, mode) -> bool:
+        """
+        Park the decoder thread of a mode until it is enabled and enough
+        samples are available. Returns False if we are shutting down.
+        """
+        mode_data = self.MODE_DICT[mode]
+        audiobuffer = mode_data['audio_buffer']
+        statistics = self.decoder_statistics[mode_data['name']]
+        with mode_data['condition']:
+            while not self.shutdown_flag.is_set():
+                if not mode_data['decode']:
+                    if not mode_data['parked']:
+                        self.close_decoder(mode)
+                        mode_data['parked'] = True
+                elif mode_data['parked']:
+                    self.open_decoder(mode)
+                    # we haven't been reading while disabled, so continue with recent samples
+                    audiobuffer.sync()
+                    mode_data['parked'] = False
+                elif audiobuffer.nbuffer >= mode_data['nin']:
+                    break
+                mode_data['condition'].wait()
+
+        if self.shutdown_flag.is_set():
+            return False
+
+        mode_data['wakeups'] += 1
+        statistics['wakeups'] = mode_data['wakeups']
+        statistics['lag'] = audiobuffer.nbuffer
+        return True
+
+    def send_buffer_overflow(self) -> None:
+        """
+        Report the overflows of all decoders
         """
-        modemStats = codec2.MODEMSTATS()
-        codec2.api.freedv_get_modem_extended_stats(freedv, ctypes.byref(modemStats))
-        offset = round(modemStats.foff) * (-1)
-        return offset
+        self.event_manager.send_buffer_overflow(
+            {name: values['overflows'] for name, values in self.decoder_statistics.items()}
+        )
 
     def demodulate_audio(self, mode) -> int:
         """
         De-modulate supplied audio stream with supplied codec2 instance.
-        Decoded audio is placed into `bytes_out`.
+        Decoded frames are placed into buffers of the mode's frame pool.
         """
 
         audiobuffer = self.MODE_DICT[mode]["audio_buffer"]
-        nin = self.MODE_DICT[mode]["nin"]
-        freedv = self.MODE_DICT[mode]["instance"]
-        bytes_out = self.MODE_DICT[mode]["bytes_out"]
-        bytes_per_frame= self.MODE_DICT[mode]["bytes_per_frame"]
         state_buffer = self.MODE_DICT[mode]["state_buffer"]
         mode_name = self.MODE_DICT[mode]["name"]
+        statistics = self.decoder_statistics[mode_name]
         try:
             while self.stream and self.stream.active and not self.shutdown_flag.is_set():
-                threading.Event().wait(0.01)
-                if audiobuffer.nbuffer >= nin and not self.shutdown_flag.is_set():
-                    # demodulate audio
-                    nbytes = codec2.api.freedv_rawdatarx(
-                        freedv, bytes_out, audiobuffer.buffer.ctypes
+                if self.wait_for_audio(mode):
+                    # the instance might have been reopened while the mode was disabled
+                    freedv = self.MODE_DICT[mode]["instance"]
+                    frame_pool = self.MODE_DICT[mode]["frame_pool"]
+                    decode_buffer = frame_pool.acquire()
+                    bytes_per_frame = self.MODE_DICT[mode]["bytes_per_frame"]
+
+                    # decode everything we have, up to the budget, before waiting again
+                    blocks = demodulator_worker.decode_blocks(
+                        self.MODE_DICT[mode], statistics, self.decode_budget, lambda: decode_buffer.c_buffer,
+                        lambda: self.MODE_DICT[mode]["decode"] and not self.shutdown_flag.is_set()
                     )
-                    # get current freedata_server states and write to list
-                    # 1 trial
-                    # 2 sync
-                    # 3 trial sync
-                    # 6 decoded
-                    # 10 error decoding == NACK
-                    rx_status = codec2.api.freedv_get_rx_status(freedv)
-
-                    if rx_status not in [0]:
-                        self.is_codec2_traffic_counter = self.is_codec2_traffic_cooldown
-                        self.log.debug(
-                            "[MDM] [demod_audio] freedata_server state", mode=mode_name, rx_status=rx_status,
-                            sync_flag=codec2.api.rx_sync_flags_to_text[rx_status]
-                        )
-
-                    # decrement codec traffic counter for making state smoother
-                    if self.is_codec2_traffic_counter > 0:
-                        self.is_codec2_traffic_counter -= 1
-                        self.states.set_channel_busy_condition_codec2(True)
-                    else:
-                        self.states.set_channel_busy_condition_codec2(False)
-                    if rx_status == 10:
-                        state_buffer.append(rx_status)
-
-                    audiobuffer.pop(nin)
-                    nin = codec2.api.freedv_nin(freedv)
-                    if nbytes == bytes_per_frame:
-                        self.log.debug(
-                            "[MDM] [demod_audio] Pushing received data to received_queue", nbytes=nbytes, mode_name=mode_name
-                        )
-                        snr = self.calculate_snr(freedv)
-                        self.get_scatter(freedv)
-
-                        item = {
-                            'payload': bytes_out,
-                            'freedv': freedv,
-                            'bytes_per_frame': bytes_per_frame,
-                            'snr': snr,
-                            'frequency_offset': self.get_frequency_offset(freedv),
-                            'mode_name': mode_name
-                        }
-
-                        self.data_queue_received.put(item)
-
-
-                        state_buffer = []
+                    for nbytes, rx_status, overflow in blocks:
+                        if overflow:
+                            self.send_buffer_overflow()
+
+                        # get current freedata_server states and write to list
+                        # 1 trial
+                        # 2 sync
+                        # 3 trial sync
+                        # 6 decoded
+                        # 10 error decoding == NACK
+                        if rx_status not in [0]:
+                            self.is_codec2_traffic_counter = self.is_codec2_traffic_cooldown
+                            self.log.debug(
+                                "[MDM] [demod_audio] freedata_server state", mode=mode_name, rx_status=rx_status,
+                                sync_flag=codec2.api.rx_sync_flags_to_text[rx_status]
+                            )
+
+                        # decrement codec traffic counter for making state smoother
+                        if self.is_codec2_traffic_counter > 0:
+                            self.is_codec2_traffic_counter -= 1
+                            self.states.set_channel_busy_condition_codec2(True)
+                        else:
+                            self.states.set_channel_busy_condition_codec2(False)
+                        if rx_status == 10:
+                            state_buffer.append(rx_status)
+
+                        if nbytes == bytes_per_frame:
+                            self.log.debug(
+                                "[MDM] [demod_audio] Pushing received data to received_queue", nbytes=nbytes, mode_name=mode_name
+                            )
+                            frame_stats = self.get_frame_stats(mode)
+
+                            item = {
+                                'payload': decode_buffer.payload,
+                                # released by the frame dispatcher
+                                'frame_buffer': decode_buffer,
+                                'freedv': freedv,
+                                'bytes_per_frame': bytes_per_frame,
+                                'snr': frame_stats['snr'],
+                                'frequency_offset': frame_stats['frequency_offset'],
+                                'sync': frame_stats['sync'],
+                                'clock_offset': frame_stats['clock_offset'],
+                                'scatter': frame_stats['scatter'],
+                                'mode_name': mode_name,
+                                # position of the frame end in the rx sample stream
+                                'sample_offset': audiobuffer.read_count,
+                                'timestamp': self.get_sample_timestamp(audiobuffer),
+                            }
+
+                            self.data_queue_received.put(item)
+                            # the queued buffer now belongs to the dispatcher
+                            decode_buffer = frame_pool.acquire()
+
+
+                            state_buffer = []
+
+                    decode_buffer.release()
+                    statistics['backlog_ms'] = self.get_backlog_ms(audiobuffer)
         except Exception as e:
             error_message = str(e)
             # we expect this error when shutdown
@@ -221,6 +333,57 @@ class Demodulator():
                     "[MDM] [demod_audio] demod loop ended", mode=mode_name, e=e
                 )
                 audio.sd._terminate()
+        finally:
+            if not self.MODE_DICT[mode]["parked"]:
+                self.close_decoder(mode)
+                self.MODE_DICT[mode]["parked"] = True
+
+    def collect_worker_results(self) -> None:
+        """
+        Forward frames, codec2 traffic state and decoder statistics of the worker processes
+        """
+        while not self.shutdown_flag.is_set():
+            try:
+                kind, data = self.process_pool.results.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            if kind == 'frame':
+                self.log.debug(
+                    "[MDM] [demod_audio] Pushing received data to received_queue", mode_name=data['mode_name']
+                )
+                # codec2 instances are living in the worker process
+                data['freedv'] = None
+                if self.is_scatter_wanted():
+                    self.send_scatter(data['scatter'])
+                else:
+                    data['scatter'] = None
+                self.data_queue_received.put(data)
+            elif kind == 'codec2_traffic':
+                worker_id, is_codec2_traffic = data
+                self.codec2_traffic_workers[worker_id] = is_codec2_traffic
+                self.states.set_channel_busy_condition_codec2(any(self.codec2_traffic_workers.values()))
+            elif kind == 'statistics':
+                for name, statistics in data.items():
+                    if statistics['overflows'] > self.decoder_statistics[name]['overflows']:
+                        self.event_manager.send_buffer_overflow({name: statistics['overflows']})
+                    self.decoder_statistics[name].update(statistics)
+
+    def update_process_pool(self) -> None:
+        for mode in self.MODE_DICT:
+            self.process_pool.set_decode(mode, self.MODE_DICT[mode]["decode"])
+
+    def get_backlog_ms(self, audiobuffer) -> float:
+        """
+        Audio a decoder has not processed yet, in milliseconds
+        """
+        return round(audiobuffer.nbuffer * 1000 / codec2.api.FREEDV_FS_8000, 1)
+
+    def get_sample_timestamp(self, audiobuffer) -> float:
+        """
+        Estimate the arrival time of the next unread sample of a decoder
+        """
+        return time.time() - audiobuffer.nbuffer / codec2.api.FREEDV_FS_8000
 
     def tci_rx_callback(self) -> None:
         """
@@ -237,19 +400,8 @@ class Demodulator():
 
             audio.calculate_fft(audio_48k, self.fft_queue, self.states)
 
-            length_audio_48k = len(audio_48k)
-            index = 0
-            for mode in self.MODE_DICT:
-                mode_data = self.MODE_DICT[mode]
-                audiobuffer = mode_data['audio_buffer']
-                decode = mode_data['decode']
-                index += 1
-                if audiobuffer:
-                    if (audiobuffer.nbuffer + length_audio_48k) > audiobuffer.size:
-                        self.buffer_overflow_counter[index] += 1
-                        self.event_manager.send_buffer_overflow(self.buffer_overflow_counter)
-                    elif decode:
-                        audiobuffer.push(audio_48k)
+            # TCI is already delivering 8 kHz audio
+            self.push_audio(audio_48k)
 
     def set_frames_per_burst(self, frames_per_burst: int) -> None:
         """
@@ -269,74 +421,47 @@ class Demodulator():
         codec2.api.freedv_set_frames_per_burst(self.dat0_datac3_freedv, frames_per_burst)
         codec2.api.freedv_set_frames_per_burst(self.dat0_datac4_freedv, frames_per_burst)
 
-    def calculate_snr(self, freedv: ctypes.c_void_p) -> float:
+    def get_frame_stats(self, mode) -> dict:
         """
-        Ask codec2 for data about the received signal and calculate
-        the signal-to-noise ratio.
+        Ask codec2 once for data about the received signal of the last frame
 
-        :param freedv: codec2 instance to query
-        :type freedv: ctypes.c_void_p
-        :return: Signal-to-noise ratio of the decoded data
-        :rtype: float
+        :param mode: codec2 mode of the decoded frame
+        :return: snr, frequency offset, sync, clock offset and scatter points
+        :rtype: dict
         """
+        freedv = self.MODE_DICT[mode]["instance"]
+        modem_stats = self.MODE_DICT[mode]["modem_stats"]
         try:
-            modem_stats_snr = ctypes.c_float()
-            modem_stats_sync = ctypes.c_int()
-
-            codec2.api.freedv_get_modem_stats(
-                freedv, ctypes.byref(modem_stats_sync), ctypes.byref(modem_stats_snr)
-            )
-            modem_stats_snr = modem_stats_snr.value
-            modem_stats_sync = modem_stats_sync.value
-
-            snr = round(modem_stats_snr, 1)
-            self.log.info("[MDM] calculate_snr: ", snr=snr)
-            # snr = np.clip(
-            #    snr, -127, 127
-            # )  # limit to max value of -128/128 as a possible fix of #188
-            return int(snr)
+            frame_stats = codec2.read_modem_stats(freedv, modem_stats)
+            self.log.info("[MDM] calculate_snr: ", snr=frame_stats['snr'])
         except Exception as err:
             self.log.error(f"[MDM] calculate_snr: Exception: {err}")
-            return 0
+            frame_stats = {'snr': 0, 'frequency_offset': 0, 'sync': 0, 'clock_offset': 0}
+
+        frame_stats['scatter'] = self.get_scatter(modem_stats)
+        return frame_stats
 
-    def get_scatter(self, freedv: ctypes.c_void_p) -> None:
+    def get_scatter(self, modem_stats: codec2.MODEMSTATS):
         """
-        Ask codec2 for data about the received signal and calculate the scatter plot.
+        Calculate the scatter plot of the last frame and send it to the clients.
 
-        :param freedv: codec2 instance to query
-        :type freedv: ctypes.c_void_p
+        :param modem_stats: extended modem stats of the last frame
+        :type modem_stats: codec2.MODEMSTATS
+        :return: scatter points, None if nobody is subscribed
         """
-       
-        modemStats = codec2.MODEMSTATS()
-        ctypes.cast(
-            codec2.api.freedv_get_modem_extended_stats(freedv, ctypes.byref(modemStats)),
-            ctypes.c_void_p,
-        )
+        if not self.is_scatter_wanted():
+            return None
+        scatterdata = demodulator_worker.get_scatter(modem_stats)
+        self.send_scatter(scatterdata)
+        return scatterdata
 
-        scatterdata = []
-        # original function before itertool
-        # for i in range(codec2.MODEM_STATS_NC_MAX):
-        #    for j in range(1, codec2.MODEM_STATS_NR_MAX, 2):
-        #        # print(f"{modemStats.rx_symbols[i][j]} - {modemStats.rx_symbols[i][j]}")
-        #        xsymbols = round(modemStats.rx_symbols[i][j - 1] // 1000)
-        #        ysymbols = round(modemStats.rx_symbols[i][j] // 1000)
-        #        if xsymbols != 0.0 and ysymbols != 0.0:
-        #            scatterdata.append({"x": str(xsymbols), "y": str(ysymbols)})
-
-        for i, j in itertools.product(range(codec2.MODEM_STATS_NC_MAX), range(1, codec2.MODEM_STATS_NR_MAX, 2)):
-            # print(f"{modemStats.rx_symbols[i][j]} - {modemStats.rx_symbols[i][j]}")
-            xsymbols = round(modemStats.rx_symbols[i][j - 1] // 1000)
-            ysymbols = round(modemStats.rx_symbols[i][j] // 1000)
-            if xsymbols != 0.0 and ysymbols != 0.0:
-                scatterdata.append({"x": str(xsymbols), "y": str(ysymbols)})
-
-        # Send all the data if we have too-few samples, otherwise send a sampling
-        if 150 > len(scatterdata) > 0:
-            self.event_manager.send_scatter_change(scatterdata)
+    def is_scatter_wanted(self) -> bool:
+        # nobody is looking at it, so we can skip it
+        return not self.scatter_on_demand or self.event_manager.has_subscribers("scatter")
 
-        else:
-            # only take every tenth data point
-            self.event_manager.send_scatter_change(scatterdata[::10])
+    def send_scatter(self, scatterdata) -> None:
+        # x and y of all points as a flat list
+        self.event_manager.send_scatter_change(scatterdata.ravel().tolist())
 
     def reset_data_sync(self) -> None:
         """
@@ -345,8 +470,10 @@ class Demodulator():
         :param frames_per_burst: Number of frames per burst requested
         :type frames_per_burst: int
         """
-        for mode in self.MODE_DICT:
-            codec2.api.freedv_set_sync(self.MODE_DICT[mode]["instance"], 0)
+        if self.process_pool:
+            self.process_pool.reset_sync()
+            return
+        codec2.instances.apply("rx", lambda freedv: codec2.api.freedv_set_sync(freedv, 0))
 
     def set_decode_mode(self, modes_to_decode=None, is_irs=False):
         # Reset all modes to not decode
@@ -371,8 +498,30 @@ class Demodulator():
                 if mode in self.MODE_DICT:
                     self.MODE_DICT[mode]["decode"] = decode
 
+        if self.process_pool:
+            self.update_process_pool()
+            return
+
+        # let decoder threads open or hand back their codec2 instances
+        for mode in self.MODE_DICT:
+            condition = self.MODE_DICT[mode]["condition"]
+            if condition and self.MODE_DICT[mode]["decode"] == self.MODE_DICT[mode]["parked"]:
+                with condition:
+                    condition.notify()
+
     def shutdown(self):
         print("shutting down demodulators...")
         self.shutdown_flag.set()
+        if self.process_pool:
+            self.process_pool.stop()
+            self.rx_history.close(unlink=True)
+            return
+        # wake up parked decoder threads, so they can leave their loop
+        for mode in self.MODE_DICT:
+            condition = self.MODE_DICT[mode]['condition']
+            if condition:
+                with condition:
+                    condition.notify_all()
         for mode in self.MODE_DICT:
-            self.MODE_DICT[mode]['decoding_thread'].join(3)
\ No newline at end of file
+            if self.MODE_DICT[mode]['decoding_thread']:
+                self.MODE_DICT[mode]['decoding_thread'].join(3)
\ No newline at end of file
@@ -0,0 +1,262 @@
+"""
+Demodulator worker processes
+
+Optional demodulator backend, which runs the codec2 decoders in separate
+processes instead of threads, so decoding is not competing with the api and
+the fft for the GIL. Workers are reading the RX history from a shared memory
+ring buffer and return decoded frames to the main process over a queue.
+"""
+import ctypes
+import multiprocessing
+import time
+import numpy as np
+import structlog
+import codec2
+
+STATISTICS_INTERVAL = 1
+CODEC2_TRAFFIC_COOLDOWN = 5
+
+
+def check_overflow(audiobuffer, statistics) -> bool:
+    """
+    Skip ahead if a decoder has fallen too far behind the RX history
+
+    The writer keeps going while a decoder is draining its buffer, so this is
+    checked before every decoded block. Overflows found by pop are counted too.
+
+    Returns:
+        True if there are new overflows to report
+    """
+    audiobuffer.check_overflow()
+    if audiobuffer.overflows == statistics['overflows']:
+        return False
+    statistics['overflows'] = audiobuffer.overflows
+    return True
+
+
+def decode_blocks(decoder, statistics, decode_budget, get_buffer, is_running):
+    """
+    Decode the buffered audio of a decoder block by block
+
+    Shared by the decoder threads and the worker processes. Stops when less
+    than nin samples are buffered, when is_running() returns False or after
+    decode_budget blocks, 0 drains the buffer.
+
+    Args:
+        decoder: dict with the codec2 'instance', its 'audio_buffer' and 'nin'
+        statistics: decoder statistics, for counting overflows
+        decode_budget: maximum number of nin blocks
+        get_buffer: returns the ctypes buffer the next frame is decoded to
+        is_running: returns False for stopping
+
+    Yields:
+        (nbytes, rx_status, overflow) after every block, overflow is True if there are new overflows to report
+    """
+    audiobuffer = decoder['audio_buffer']
+    freedv = decoder['instance']
+    decoded_blocks = 0
+    while audiobuffer.nbuffer >= decoder['nin'] and is_running():
+        if 0 < decode_budget <= decoded_blocks:
+            # give the other modes a turn and continue in the next round
+            return
+        decoded_blocks += 1
+        overflow = check_overflow(audiobuffer, statistics)
+        nbytes = codec2.api.freedv_rawdatarx(freedv, get_buffer(), audiobuffer.buffer.ctypes)
+        rx_status = codec2.api.freedv_get_rx_status(freedv)
+        audiobuffer.pop(decoder['nin'])
+        decoder['nin'] = codec2.api.freedv_nin(freedv)
+        yield nbytes, rx_status, overflow
+
+
+def get_scatter(modem_stats) -> np.ndarray:
+    """
+    Scatter points of the last frame, a sampling of them if there are many
+    """
+    scatterdata = codec2.get_scatter_points(modem_stats)
+
+    # Send all the data if we have too-few samples, otherwise send a sampling
+    if not 150 > len(scatterdata) > 0:
+        # only take every tenth data point
+        scatterdata = scatterdata[::10]
+    return scatterdata
+
+
+def open_decoder(index, mode, history, max_lag):
+    freedv = codec2.open_instance(mode)
+    codec2.api.freedv_set_frames_per_burst(freedv, 1)
+    bytes_per_frame = codec2.read_geometry(freedv)["bytes_per_frame"]
+    return {
+        'index': index,
+        'name': codec2.FREEDV_MODE(mode).name.upper(),
+        'instance': freedv,
+        'bytes_per_frame': bytes_per_frame,
+        'bytes_out': ctypes.create_string_buffer(bytes_per_frame),
+        'audio_buffer': history.reader(max_lag),
+        'nin': codec2.api.freedv_nin(freedv),
+        'modem_stats': codec2.MODEMSTATS(),
+        'parked': True,
+        'statistics': {'wakeups': 0, 'lag': 0, 'overflows': 0, 'backlog_ms': 0},
+    }
+
+
+def run_worker(worker_id, modes, history_name, history_size, max_lag, decode_budget,
+               decode_flags, sync_generation, wakeup, shutdown, results):
+    """
+    Decoder loop of a worker process
+
+    Args:
+        worker_id: id of the worker, used for reporting codec2 traffic
+        modes: list of (index, mode value) tuples this worker is decoding
+        history_name: name of the shared memory RX history
+        history_size: size of the RX history in samples
+        max_lag: number of samples a decoder may fall behind
+        decode_budget: maximum number of nin blocks decoded per mode and round, 0 drains the buffer
+        decode_flags: shared array of decode flags, indexed by mode index
+        sync_generation: shared counter, incremented for resetting the decoder sync
+        wakeup: event, set by the main process when new samples are available
+        shutdown: event for stopping the worker
+        results: queue for returning frames, traffic state and statistics
+    """
+    log = structlog.get_logger("Demodulator Worker")
+    history = codec2.shared_memory_ring_buffer(history_size, name=history_name)
+    decoders = [open_decoder(index, mode, history, max_lag) for index, mode in modes]
+    log.info("[MDM] demodulator worker started", worker=worker_id, modes=[d['name'] for d in decoders])
+
+    codec2_traffic_counter = 0
+    codec2_traffic = False
+    last_sync_generation = sync_generation.value
+    last_statistics = time.time()
+
+    try:
+        while not shutdown.is_set():
+            wakeup.wait(STATISTICS_INTERVAL)
+            wakeup.clear()
+
+            if sync_generation.value != last_sync_generation:
+                last_sync_generation = sync_generation.value
+                for decoder in decoders:
+                    codec2.api.freedv_set_sync(decoder['instance'], 0)
+
+            for decoder in decoders:
+                audiobuffer = decoder['audio_buffer']
+                if not decode_flags[decoder['index']]:
+                    decoder['parked'] = True
+                    continue
+                if decoder['parked']:
+                    # we haven't been reading while disabled, so continue with recent samples
+                    audiobuffer.sync()
+                    decoder['parked'] = False
+                    continue
+                if audiobuffer.nbuffer < decoder['nin']:
+                    continue
+
+                statistics = decoder['statistics']
+                statistics['wakeups'] += 1
+
+                blocks = decode_blocks(
+                    decoder, statistics, decode_budget, lambda: decoder['bytes_out'], lambda: not shutdown.is_set()
+                )
+                for nbytes, rx_status, _ in blocks:
+                    if rx_status not in [0]:
+                        codec2_traffic_counter = CODEC2_TRAFFIC_COOLDOWN
+                    elif codec2_traffic_counter > 0:
+                        codec2_traffic_counter -= 1
+
+                    if nbytes == decoder['bytes_per_frame']:
+                        frame_stats = codec2.read_modem_stats(decoder['instance'], decoder['modem_stats'])
+                        results.put(('frame', {
+                            'payload': bytes(decoder['bytes_out']),
+                            'bytes_per_frame': decoder['bytes_per_frame'],
+                            'snr': frame_stats['snr'],
+                            'frequency_offset': frame_stats['frequency_offset'],
+                            'sync': frame_stats['sync'],
+                            'clock_offset': frame_stats['clock_offset'],
+                            'scatter': get_scatter(decoder['modem_stats']),
+                            'mode_name': decoder['name'],
+                            # position of the frame end in the rx sample stream
+                            'sample_offset': audiobuffer.read_count,
+                            'timestamp': time.time() - audiobuffer.nbuffer / codec2.api.FREEDV_FS_8000,
+                        }))
+                if audiobuffer.nbuffer >= decoder['nin'] and not shutdown.is_set():
+                    # the decode budget is used up, continue in the next round
+                    wakeup.set()
+                statistics['lag'] = audiobuffer.nbuffer
+                statistics['backlog_ms'] = round(audiobuffer.nbuffer * 1000 / codec2.api.FREEDV_FS_8000, 1)
+
+            # only report changes of the codec2 traffic state
+            if (codec2_traffic_counter > 0) != codec2_traffic:
+                codec2_traffic = codec2_traffic_counter > 0
+                results.put(('codec2_traffic', (worker_id, codec2_traffic)))
+
+            if time.time() - last_statistics >= STATISTICS_INTERVAL:
+                last_statistics = time.time()
+                results.put(('statistics', {d['name']: dict(d['statistics']) for d in decoders}))
+    except Exception as e:
+        log.warning("[MDM] demodulator worker ended", worker=worker_id, e=e)
+    finally:
+        for decoder in decoders:
+            del decoder['audio_buffer']
+        history.close()
+
+
+class DemodulatorProcessPool:
+    """
+    Distribute the decoders of all modes over a number of worker processes
+    """
+
+    def __init__(self, modes, processes, history, max_lag, decode_budget=0):
+        self.log = structlog.get_logger("Demodulator Process Pool")
+        # we are not forking the server process with all its threads and open devices
+        self.context = multiprocessing.get_context("spawn")
+
+        self.modes = list(modes)
+        self.history = history
+        self.max_lag = max_lag
+        self.decode_budget = decode_budget
+
+        self.decode_flags = self.context.Array('b', len(self.modes), lock=False)
+        self.sync_generation = self.context.Value('i', 0, lock=False)
+        self.shutdown_event = self.context.Event()
+        self.results = self.context.Queue()
+
+        indexed_modes = list(enumerate(self.modes))
+        self.groups = [group for group in (indexed_modes[i::processes] for i in range(processes)) if group]
+        self.workers = []
+
+    def start(self):
+        for worker_id, group in enumerate(self.groups):
+            wakeup = self.context.Event()
+            process = self.context.Process(
+                target=run_worker,
+                args=(worker_id, group, self.history.name, self.history.size, self.max_lag, self.decode_budget,
+                      self.decode_flags, self.sync_generation, wakeup, self.shutdown_event, self.results),
+                name=f"DEMODULATOR WORKER {worker_id}",
+                daemon=True,
+            )
+            process.start()
+            self.workers.append({'process': process, 'wakeup': wakeup, 'indexes': [index for index, _ in group]})
+        self.log.info("[MDM] demodulator processes started", processes=len(self.workers))
+
+    def set_decode(self, mode, decode: bool):
+        self.decode_flags[self.modes.index(mode)] = decode
+
+    def notify(self):
+        """
+        Wake up all workers which have an enabled mode
+        """
+        for worker in self.workers:
+            if any(self.decode_flags[index] for index in worker['indexes']):
+                worker['wakeup'].set()
+
+    def reset_sync(self):
+        self.sync_generation.value += 1
+
+    def stop(self):
+        self.shutdown_event.set()
+        for worker in self.workers:
+            worker['wakeup'].set()
+        for worker in self.workers:
+            worker['process'].join(3)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+        self.workers = []
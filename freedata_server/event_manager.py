@@ -1,19 +1,154 @@
 import base64
+import collections
 import json
+import queue
+import threading
 import structlog
 
+TOPICS = ['arq', 'ptt', 'scatter', 'fft', 'state', 'frame-handler', 'message-db', 'other']
+
+# What happens to pending events of a subscriber which is falling behind, by rule
+#   coalesce: a pending event of the same kind is replaced by the new one
+#   never-drop: the event is kept, even if the queue is full
+#   drop-oldest: the oldest droppable event is discarded if the queue is full
+DEFAULT_RETENTION = {
+    'arq-progress': 'coalesce',
+    'arq': 'never-drop',
+    'ptt': 'never-drop',
+    'scatter': 'coalesce',
+    'fft': 'coalesce',
+    'buffer-overflow': 'coalesce',
+    'state': 'never-drop',
+    'frame-handler': 'drop-oldest',
+    'message-db': 'never-drop',
+    'other': 'drop-oldest',
+}
+
+RETENTION_POLICIES = ['coalesce', 'never-drop', 'drop-oldest']
+
+
+def parse_retention(entries) -> dict:
+    """
+    Retention rules from the config, given as a list of "rule:policy" strings
+    """
+    retention = {}
+    for entry in entries:
+        rule, _, policy = str(entry).partition(':')
+        rule, policy = rule.strip(), policy.strip()
+        if rule not in DEFAULT_RETENTION or policy not in RETENTION_POLICIES:
+            structlog.get_logger('Event Manager').warning("[EVT] Invalid event retention", entry=entry)
+            continue
+        retention[rule] = policy
+    return retention
+
+
+def classify_event(event):
+    """
+    Get topic, retention rule and coalesce key of an event
+    """
+    if isinstance(event, list):
+        return 'fft', 'fft', 'fft'
+    if not isinstance(event, dict):
+        return 'other', 'other', None
+    if event.get("type") == "arq":
+        for key, details in event.items():
+            # progress updates are superseded by the next one of the same session
+            if key.startswith("arq-transfer-") and isinstance(details, dict) and 'received_bytes' in details:
+                return 'arq', 'arq-progress', ('arq-progress', key, details.get('session_id'))
+        return 'arq', 'arq', None
+    if "ptt" in event:
+        return 'ptt', 'ptt', 'ptt'
+    if "scatter" in event:
+        return 'scatter', 'scatter', 'scatter'
+    if "buffer-overflow" in event:
+        return 'state', 'buffer-overflow', 'buffer-overflow'
+    if "freedata_server" in event:
+        return 'state', 'state', None
+    if event.get("type") == "frame-handler":
+        return 'frame-handler', 'frame-handler', None
+    if "message-db" in event:
+        return 'message-db', 'message-db', None
+    return 'other', 'other', None
+
+
+class EventQueue:
+    """
+    Bounded event queue of a single subscriber with per topic retention.
+    Has the put/get interface of queue.Queue.
+    """
+
+    def __init__(self, maxsize=256, topics=None, retention=None):
+        self.maxsize = maxsize
+        self.topics = set(topics) if topics else None
+        self.retention = dict(DEFAULT_RETENTION)
+        if retention:
+            self.retention.update(retention)
+        # pending events as [coalesce key, droppable, event]
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        self.statistics = {'queued': 0, 'dropped': 0, 'coalesced': 0}
+
+    def put(self, event) -> None:
+        topic, rule, key = classify_event(event)
+        if self.topics is not None and topic not in self.topics:
+            return
+        policy = self.retention.get(rule, 'drop-oldest')
+        with self.condition:
+            if policy == 'coalesce':
+                for entry in self.pending:
+                    if entry[0] == key:
+                        entry[2] = event
+                        self.statistics['coalesced'] += 1
+                        return
+            droppable = policy != 'never-drop'
+            if len(self.pending) >= self.maxsize and not self.drop_oldest():
+                if droppable:
+                    # the queue is full of events we must not drop
+                    self.statistics['dropped'] += 1
+                    return
+            self.pending.append([key if policy == 'coalesce' else None, droppable, event])
+            self.statistics['queued'] += 1
+            self.condition.notify()
+
+    def drop_oldest(self) -> bool:
+        for index, entry in enumerate(self.pending):
+            if entry[1]:
+                del self.pending[index]
+                self.statistics['dropped'] += 1
+                return True
+        return False
+
+    def get(self, block=True, timeout=None):
+        with self.condition:
+            if block:
+                self.condition.wait_for(lambda: self.pending, timeout)
+            if not self.pending:
+                raise queue.Empty
+            return self.pending.popleft()[2]
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self) -> int:
+        return len(self.pending)
+
+    def empty(self) -> bool:
+        return not self.pending
+
+
 class EventManager:
 
     def __init__(self, queues):
+        # subscribers, EventQueues are applying their own retention policy
         self.queues = queues
         self.logger = structlog.get_logger('Event Manager')
         self.lastpttstate = False
+        # topics websocket clients have subscribed to, by client
+        self.subscriptions = {}
 
     def broadcast(self, data):
+        self.logger.debug(f"Event: ", ev=data)
         for q in self.queues:
-            self.logger.debug(f"Event: ", ev=data)
-            if q.qsize() > 10:
-                q.queue.clear()
             q.put(data)
 
     def send_ptt_change(self, on:bool = False):
@@ -22,8 +157,21 @@ class EventManager:
         self.lastpttstate= on
         self.broadcast({"ptt": bool(on)})
 
+    def subscribe(self, client, topics):
+        self.subscriptions.setdefault(client, set()).update(topics)
+
+    def unsubscribe(self, client, topics=None):
+        if topics is None:
+            self.subscriptions.pop(client, None)
+        elif client in self.subscriptions:
+            self.subscriptions[client].difference_update(topics)
+
+    def has_subscribers(self, topic) -> bool:
+        return any(topic in topics for topics in list(self.subscriptions.values()))
+
     def send_scatter_change(self, data):
-        self.broadcast({"scatter": json.dumps(data)})
+        # flat list of x and y values
+        self.broadcast({"scatter": data})
 
     def send_buffer_overflow(self, data):
         self.broadcast({"buffer-overflow": str(data)})
@@ -0,0 +1,58 @@
+"""
+Pooled buffers for decoded frames
+
+codec2 decodes a frame directly into a pooled buffer. The frame is handed to
+the frame dispatcher as read-only view on that buffer, so it can't be
+overwritten by the next decode while it is queued. The dispatcher hands the
+buffer back to its pool, once the frame has been processed.
+"""
+import collections
+import ctypes
+
+
+class FrameBuffer:
+    """
+    Fixed size buffer for a single decoded frame
+    """
+
+    def __init__(self, pool, size: int):
+        self.pool = pool
+        self.storage = bytearray(size)
+        # target of freedv_rawdatarx
+        self.c_buffer = (ctypes.c_ubyte * size).from_buffer(self.storage)
+        # what consumers are getting to see
+        self.payload = memoryview(self.storage).toreadonly()
+
+    def release(self) -> None:
+        """
+        Hand the buffer back to its pool, the payload must not be used afterwards
+        """
+        self.pool.release(self)
+
+
+class FrameBufferPool:
+    """
+    Pool of frame buffers of the same size, usually one per codec2 mode
+    """
+
+    def __init__(self, size: int, count: int = 4):
+        self.size = size
+        self.count = count
+        # deque append and pop are atomic, so we don't need a lock
+        self.free = collections.deque(FrameBuffer(self, size) for _ in range(count))
+        self.allocated = count
+
+    def acquire(self) -> FrameBuffer:
+        """
+        Take a free buffer, a new one is allocated if the pool is exhausted
+        """
+        try:
+            return self.free.pop()
+        except IndexError:
+            self.allocated += 1
+            return FrameBuffer(self, self.size)
+
+    def release(self, frame_buffer: FrameBuffer) -> None:
+        # buffers allocated during a burst of frames are dropped again
+        if len(self.free) < self.count:
+            self.free.append(frame_buffer)
@@ -3,8 +3,11 @@ FRAME DISPATCHER - We are dispatching the received frames to the needed function
 
 
 """
+import bisect
 import threading
+import time
 import structlog
+import helpers
 from modem_frametypes import FRAME_TYPE as FR_TYPE
 import event_manager
 from data_frame_factory import DataFrameFactory
@@ -18,6 +21,10 @@ from frame_handler_beacon import BeaconFrameHandler
 
 
 
+# upper bounds of the rx latency histogram buckets in ms
+RX_LATENCY_BUCKETS = [10, 20, 50, 100, 200, 500, 1000, 2000]
+
+
 class DISPATCHER():
 
     FRAME_HANDLER = {
@@ -68,6 +75,16 @@ class DISPATCHER():
 
         self.arq_sessions = []
 
+        # time from the end of a frame at the audio input until we are dispatching it
+        self.rx_latency = {
+            'profile': helpers.get_latency_profile(config)[0],
+            'count': 0,
+            'mean_ms': 0,
+            'max_ms': 0,
+            'histogram': {str(bound): 0 for bound in RX_LATENCY_BUCKETS + ['inf']},
+        }
+        self.states.register_modem_statistics("rx_latency", self.rx_latency)
+
 
     def _initialize_handlers(self, config, states):
         """Initializes various data handlers."""
@@ -86,19 +103,41 @@ class DISPATCHER():
         while not self.stop_event.is_set():
             try:
                 data = self.data_queue_received.get(timeout=1)
-                if data:
-                    self.process_data(
-                        data['payload'],
-                        data['freedv'],
-                        data['bytes_per_frame'],
-                        data['snr'],
-                        data['frequency_offset'],
-                        data['mode_name'],
-                    )
             except Exception:
                 continue
-
-    def process_data(self, bytes_out, freedv, bytes_per_frame: int, snr, frequency_offset, mode_name) -> None:
+            if not data:
+                continue
+            if data.get('timestamp'):
+                self.update_rx_latency(data['timestamp'])
+            try:
+                self.process_data(
+                    data['payload'],
+                    data['freedv'],
+                    data['bytes_per_frame'],
+                    data['snr'],
+                    data['frequency_offset'],
+                    data['mode_name'],
+                    sync=data.get('sync', 0),
+                    clock_offset=data.get('clock_offset', 0),
+                )
+            except Exception:
+                continue
+            finally:
+                # the payload is a view on a pooled buffer, which we can reuse now
+                if data.get('frame_buffer'):
+                    data['frame_buffer'].release()
+
+    def update_rx_latency(self, timestamp: float) -> None:
+        latency_ms = max((time.time() - timestamp) * 1000, 0)
+        stats = self.rx_latency
+        stats['count'] += 1
+        stats['mean_ms'] = round(stats['mean_ms'] + (latency_ms - stats['mean_ms']) / stats['count'], 1)
+        stats['max_ms'] = max(stats['max_ms'], round(latency_ms, 1))
+        index = bisect.bisect_left(RX_LATENCY_BUCKETS, latency_ms)
+        bucket = str(RX_LATENCY_BUCKETS[index]) if index < len(RX_LATENCY_BUCKETS) else 'inf'
+        stats['histogram'][bucket] += 1
+
+    def process_data(self, bytes_out, freedv, bytes_per_frame: int, snr, frequency_offset, mode_name, sync=0, clock_offset=0) -> None:
         # get frame as dictionary
         deconstructed_frame = self.frame_factory.deconstruct(bytes_out, mode_name=mode_name)
         frametype = deconstructed_frame["frame_type_int"]
@@ -115,7 +154,7 @@ class DISPATCHER():
                                 self.states,
                                 self.event_manager,
                                 self.modem)
-        handler.handle(deconstructed_frame, snr, frequency_offset, freedv, bytes_per_frame)
+        handler.handle(deconstructed_frame, snr, frequency_offset, freedv, bytes_per_frame, sync, clock_offset)
 
     def get_id_from_frame(self, data):
         if data[:1] == FR_TYPE.ARQ_SESSION_OPEN:
@@ -29,7 +29,9 @@ class FrameHandler():
             'snr' : 0, 
             'frequency_offset': 0,
             'freedv_inst': None, 
-            'bytes_per_frame': 0
+            'bytes_per_frame': 0,
+            'sync': 0,
+            'clock_offset': 0,
         }
 
     def is_frame_for_me(self):
@@ -207,12 +209,14 @@ class FrameHandler():
     def log(self):
         self.logger.info(f"[Frame Handler] Handling frame {self.details['frame']['frame_type']}")
 
-    def handle(self, frame, snr, frequency_offset, freedv_inst, bytes_per_frame):
+    def handle(self, frame, snr, frequency_offset, freedv_inst, bytes_per_frame, sync=0, clock_offset=0):
         self.details['frame'] = frame
         self.details['snr'] = snr
         self.details['frequency_offset'] = frequency_offset
         self.details['freedv_inst'] = freedv_inst
         self.details['bytes_per_frame'] = bytes_per_frame
+        self.details['sync'] = sync
+        self.details['clock_offset'] = clock_offset
 
         # look in database for a full callsign if only crc is present
         if 'origin' not in frame and 'origin_crc' in frame:
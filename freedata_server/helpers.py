@@ -23,6 +23,28 @@ import glob
 log = structlog.get_logger("helpers")
 
 
+# rx stream block duration, samples a decoder may fall behind and fft interval, all in ms
+LATENCY_PROFILES = {
+    'low': {'rx_block_ms': 20, 'rx_buffer_ms': 1000, 'fft_interval_ms': 200},
+    'balanced': {'rx_block_ms': 50, 'rx_buffer_ms': 1200, 'fft_interval_ms': 100},
+    'throughput': {'rx_block_ms': 100, 'rx_buffer_ms': 1200, 'fft_interval_ms': 100},
+}
+DEFAULT_LATENCY_PROFILE = 'throughput'
+
+
+def get_latency_profile(config) -> tuple:
+    """
+    Look up the configured latency profile
+
+    Returns:
+        name and settings of the profile, the default profile for unknown names
+    """
+    name = str(config['AUDIO'].get('latency_profile', '')).lower()
+    if name not in LATENCY_PROFILES:
+        name = DEFAULT_LATENCY_PROFILE
+    return name, LATENCY_PROFILES[name]
+
+
 def wait(seconds: float) -> bool:
     """
 
@@ -10,7 +10,9 @@ Created on Wed Dec 23 07:04:24 2020
 # pylint: disable=import-outside-toplevel
 
 import queue
+import threading
 import time
+from time import perf_counter
 import codec2
 import numpy as np
 import sounddevice as sd
@@ -18,6 +20,7 @@ import structlog
 import tci
 import cw
 import audio
+import helpers
 import demodulator
 import modulator
 
@@ -52,6 +55,10 @@ class RF:
 
         self.tx_audio_level = config['AUDIO']['tx_audio_level']
         self.rx_audio_level = config['AUDIO']['rx_audio_level']
+        self.tx_gain = audio.GainStage(self.tx_audio_level)
+        self.rx_gain = audio.GainStage(self.rx_audio_level)
+        # open the audio devices at 8 kHz, if they are supporting it
+        self.native_samplerate = config['AUDIO'].get('native_samplerate', False)
 
 
         self.ptt_state = False
@@ -59,6 +66,43 @@ class RF:
 
         self.AUDIO_SAMPLE_RATE = 48000
         self.modem_sample_rate = codec2.api.FREEDV_FS_8000
+        # sample rates the audio streams are running at, set by init_audio
+        self.rx_sample_rate = self.AUDIO_SAMPLE_RATE
+        self.tx_sample_rate = self.AUDIO_SAMPLE_RATE
+
+        # the latency profile sets rx block size and fft cadence
+        self.latency_profile, latency_settings = helpers.get_latency_profile(config)
+        self.rx_block_ms = latency_settings['rx_block_ms']
+        # the fft is calculated on the latest 100ms of rx audio, every fft interval
+        self.fft_interval = self.modem_sample_rate * latency_settings['fft_interval_ms'] // 1000
+        self.fft_length = self.modem_sample_rate // 10
+        self.fft_samples = 0
+
+        # the input callback only copies samples to the raw rx buffer, the dsp thread does the rest
+        self.rx_raw_buffer = None
+        self.rx_dsp_event = threading.Event()
+        self.rx_dsp_stop = threading.Event()
+        self.audio_input_statistics = {
+            'input_overflows': 0,
+            'raw_buffer_overflows': 0,
+            'callbacks': 0,
+            'callback_ms_mean': 0,
+            'callback_ms_max': 0,
+        }
+        self.states.register_modem_statistics("audio_input", self.audio_input_statistics)
+        self.states.register_modem_statistics(
+            "audio_gain", {'rx': self.rx_gain.statistics, 'tx': self.tx_gain.statistics}
+        )
+        # time from RF.transmit to the first block taken by the output callback
+        self.tx_start = None
+        self.audio_output_statistics = {
+            'transmissions': 0,
+            'time_to_first_sample_ms': 0,
+            'time_to_first_sample_ms_mean': 0,
+            'time_to_first_sample_ms_max': 0,
+            'underruns': 0,
+        }
+        self.states.register_modem_statistics("audio_output", self.audio_output_statistics)
 
         # 8192 Let's do some tests with very small chunks for TX
         #self.AUDIO_FRAMES_PER_BUFFER_TX = 1200 if self.radiocontrol in ["tci"] else 2400 * 2
@@ -67,7 +111,16 @@ class RF:
         self.MODE = 0
         self.rms_counter = 0
 
-        self.audio_out_queue = queue.Queue()
+        # TX audio is written to a ring, the output callback only copies from it.
+        # The 8 kHz signal of the TX audio is kept for the spectrum, set by init_audio
+        self.tx_ring = None
+        self.tx_history = None
+        self.tx_history_start = (0, 0)
+        self.tx_space_event = threading.Event()
+        self.audio_out_cleared = threading.Event()
+        # set by the output callback with the DAC time of the last sample of a transmission
+        self.tx_drained = threading.Event()
+        self.tx_last_sample_time = None
 
         # Make sure our resampler will work
         assert (self.AUDIO_SAMPLE_RATE / self.modem_sample_rate) == codec2.api.FDMDV_OS_48  # type: ignore
@@ -86,12 +139,15 @@ class RF:
                                                    )
 
         self.modulator = modulator.Modulator(self.config)
+        self.tx_resampler = None
+        self.states.register_modem_statistics("tx_waveform_cache", self.modulator.waveform_cache.statistics)
+        self.states.register_modem_statistics("tx_burst_cache", self.modulator.burst_cache.statistics)
+        self.states.register_modem_statistics("tx_piece_cache", self.modulator.piece_cache.statistics)
 
 
 
     def tci_tx_callback(self, audio_48k) -> None:
-        self.radio.set_ptt(True)
-        self.event_manager.send_ptt_change(True)
+        # PTT is keyed by enqueue_audio_out
         self.tci_module.push_audio(audio_48k)
 
     def start_modem(self):
@@ -115,6 +171,10 @@ class RF:
             # self.stream = lambda: None
             # self.stream.active = False
             # self.stream.stop
+            self.rx_dsp_stop.set()
+            self.rx_dsp_event.set()
+            # wake up and stop parked decoder threads
+            self.demodulator.shutdown()
             self.sd_input_stream.close()
             self.sd_output_stream.close()
         except Exception as e:
@@ -140,11 +200,30 @@ class RF:
             self.log.info(f"[MDM] init: transmiting audio on '{out_dev_name}'")
             self.log.debug("[MDM] init: starting pyaudio callback and decoding threads")
 
+            self.rx_sample_rate = self.select_sample_rate(in_dev_index, True)
+            self.tx_sample_rate = self.select_sample_rate(out_dev_index, False)
+
             sd.default.samplerate = self.AUDIO_SAMPLE_RATE
             sd.default.device = (in_dev_index, out_dev_index)
 
-            # init codec2 resampler
-            self.resampler = codec2.resampler()
+            rx_blocksize = self.rx_sample_rate * self.rx_block_ms // 1000
+            self.log.info("[MDM] init: latency profile", profile=self.latency_profile, rx_blocksize=rx_blocksize)
+
+            # init codec2 resamplers, one per stream direction as they are keeping filter memory
+            self.rx_resampler = codec2.streaming_resampler(rx_blocksize)
+            self.tx_resampler = codec2.streaming_resampler(2400)
+            self.rx_audio_8k = np.zeros(rx_blocksize // codec2.api.FDMDV_OS_48, dtype=np.int16)  # type: ignore
+
+            # one second of raw input audio for the dsp thread
+            self.rx_blocksize = rx_blocksize
+            self.rx_raw_buffer = codec2.ring_buffer(self.rx_sample_rate)
+            self.rx_dsp_stop.clear()
+            threading.Thread(target=self.rx_dsp_worker, name="RX DSP", daemon=True).start()
+
+            # one second of TX audio ahead of the output callback, the history
+            # is keeping the 8 kHz signal of it and of the fft window before
+            self.tx_ring = codec2.ring_buffer(self.tx_sample_rate)
+            self.tx_history = codec2.shared_ring_buffer(2 * self.modem_sample_rate)
 
             # SoundDevice audio input stream
             self.sd_input_stream = sd.InputStream(
@@ -152,8 +231,8 @@ class RF:
                 dtype="int16",
                 callback=self.sd_input_audio_callback,
                 device=in_dev_index,
-                samplerate=self.AUDIO_SAMPLE_RATE,
-                blocksize=4800,
+                samplerate=self.rx_sample_rate,
+                blocksize=rx_blocksize,
             )
             self.sd_input_stream.start()
 
@@ -162,8 +241,9 @@ class RF:
                 dtype="int16",
                 callback=self.sd_output_audio_callback,
                 device=out_dev_index,
-                samplerate=self.AUDIO_SAMPLE_RATE,
-                blocksize=2400,
+                samplerate=self.tx_sample_rate,
+                # 50ms
+                blocksize=self.tx_sample_rate // 20,
             )
             self.sd_output_stream.start()
 
@@ -174,6 +254,17 @@ class RF:
             self.stop_modem()
             return False
 
+    def select_sample_rate(self, device_index, isInput: bool) -> int:
+        """
+        Use 8 kHz directly if enabled and supported by the device, so we can skip
+        the re-sampling. Otherwise fall back to 48 kHz.
+        """
+        if self.native_samplerate and audio.check_samplerate(device_index, isInput, self.modem_sample_rate):
+            self.log.info("[MDM] init: using native sample rate", samplerate=self.modem_sample_rate,
+                          isInput=isInput)
+            return self.modem_sample_rate
+        return self.AUDIO_SAMPLE_RATE
+
     def init_tci(self):
         # placeholder area for processing audio via TCI
         # https://github.com/maksimus1210/TCI
@@ -202,7 +293,7 @@ class RF:
         )
         start_of_transmission = time.time()
 
-        txbuffer_out = cw.MorseCodePlayer().text_to_signal(self.config['STATION'].mycall)
+        txbuffer_out = cw.MorseCodePlayer(fs=self.tx_sample_rate).text_to_signal(self.config['STATION'].mycall)
 
         # transmit audio
         self.enqueue_audio_out(txbuffer_out)
@@ -223,110 +314,243 @@ class RF:
         # self.states.channel_busy_event.wait()
 
         start_of_transmission = time.time()
-        txbuffer = self.modulator.create_burst(mode, repeats, repeat_delay, frames)
-
-        # Re-sample back up to 48k (resampler works on np.int16)
-        x = np.frombuffer(txbuffer, dtype=np.int16)
-        x = audio.set_audio_volume(x, self.tx_audio_level)
-
         if self.radiocontrol not in ["tci"]:
-            txbuffer_out = self.resampler.resample8_to_48(x)
+            self.tx_start = perf_counter()
+            # frames are modulated while the audio of the previous ones is already playing
+            txbuffer_out = self.modulator.stream_output_burst(
+                mode, repeats, repeat_delay, frames, self.tx_gain, self.tx_sample_rate, self.tx_resampler
+            )
         else:
-            txbuffer_out = x
-
-
+            # TCI is taking 8 kHz audio at once
+            txbuffer_out = self.modulator.get_output_burst(
+                mode, repeats, repeat_delay, frames, self.tx_gain, self.modem_sample_rate
+            )
 
         # transmit audio
         self.enqueue_audio_out(txbuffer_out)
 
         end_of_transmission = time.time()
         transmission_time = end_of_transmission - start_of_transmission
-        self.log.debug("[MDM] ON AIR TIME", time=transmission_time)
+        self.log.debug("[MDM] ON AIR TIME", time=transmission_time,
+                       time_to_first_sample_ms=self.audio_output_statistics['time_to_first_sample_ms'])
 
 
 
     def enqueue_audio_out(self, audio_48k) -> None:
+        """
+        Write audio to the TX ring, key PTT and wait until it has been played
+
+        audio_48k is an array or an iterable of (audio, audio_8k) pieces, which
+        are written as soon as they are available. audio_8k is the 8 kHz signal
+        for the TX spectrum or None. PTT is keyed with the first samples and
+        released when the last sample has left the audio device.
+        """
         self.enqueuing_audio = True
+        self.audio_out_cleared.clear()
+        self.tx_drained.clear()
         if not self.states.isTransmitting():
             self.states.setTransmitting(True)
 
-        self.radio.set_ptt(True)
-
-        self.event_manager.send_ptt_change(True)
+        if isinstance(audio_48k, np.ndarray):
+            audio_48k = [(audio_48k, None)]
 
         if self.radiocontrol in ["tci"]:
+            audio_48k = np.concatenate([chunk for chunk, _ in audio_48k])
+            self.key_ptt()
             self.tci_tx_callback(audio_48k)
             # we need to wait manually for tci processing
             self.tci_module.wait_until_transmitted(audio_48k)
         else:
-            # slice audio data to needed blocklength
-            block_size = self.sd_output_stream.blocksize
-            pad_length = -len(audio_48k) % block_size
-            padded_data = np.pad(audio_48k, (0, pad_length), mode='constant')
-            sliced_audio_data = padded_data.reshape(-1, block_size)
-            # add each block to audio out queue
-            for block in sliced_audio_data:
-                self.audio_out_queue.put(block)
-
+            self.tx_history_start = (self.tx_ring.write_count, self.tx_history.write_count)
+            for chunk, chunk_8k in audio_48k:
+                if not self.write_tx_ring(chunk, chunk_8k):
+                    break
+            self.enqueuing_audio = False
+            self.wait_until_played()
 
         self.enqueuing_audio = False
-        self.states.transmitting_event.wait()
-
         self.radio.set_ptt(False)
+        self.ptt_state = False
         self.event_manager.send_ptt_change(False)
+        self.states.setTransmitting(False)
 
         return
 
-    def sd_output_audio_callback(self, outdata: np.ndarray, frames: int, time, status) -> None:
+    def write_tx_ring(self, chunk, chunk_8k) -> bool:
+        """
+        Write a piece of audio to the TX ring, waiting for the output callback if it is full
+
+        Returns:
+            False if the audio output has been cleared
+        """
+        ratio = self.tx_sample_rate // self.modem_sample_rate
+        position = 0
+        while position < len(chunk):
+            if self.audio_out_cleared.is_set():
+                return False
+            # keep the 8 kHz signal in step with the TX audio
+            free = (self.tx_ring.size - self.tx_ring.nbuffer) // ratio * ratio
+            if free == 0:
+                self.tx_space_event.clear()
+                self.tx_space_event.wait(0.1)
+                continue
+            end = min(len(chunk), position + free)
+            self.tx_ring.write(chunk[position:end])
+            if chunk_8k is not None:
+                self.tx_history.push(chunk_8k[position // ratio:end // ratio])
+            if not self.ptt_state:
+                self.key_ptt()
+            position = end
+        return True
 
-        try:
-            if not self.audio_out_queue.empty() and not self.enqueuing_audio:
-                chunk = self.audio_out_queue.get_nowait()
-                audio_8k = self.resampler.resample48_to_8(chunk)
-                audio.calculate_fft(audio_8k, self.fft_queue, self.states)
-                outdata[:] = chunk.reshape(outdata.shape)
+    def wait_until_played(self) -> None:
+        """
+        Wait for the output callback to play the last sample and until it has left the audio device
+        """
+        if not self.ptt_state:
+            return
+        if not self.tx_drained.wait(self.tx_ring.nbuffer / self.tx_sample_rate + 1):
+            self.log.warning("[MDM] TX audio not drained by the output callback")
+            return
+        if self.tx_last_sample_time is None:
+            return
+        delay = self.tx_last_sample_time - self.sd_output_stream.time
+        if 0 < delay < 1:
+            threading.Event().wait(delay)
+
+    def clear_audio_out(self) -> None:
+        """
+        Drop the queued audio and stop queueing the rest of a burst
+        """
+        self.audio_out_cleared.set()
+
+    def key_ptt(self) -> None:
+        self.radio.set_ptt(True)
+        self.ptt_state = True
+        self.event_manager.send_ptt_change(True)
 
-            else:
-                # reset transmitting state only, if we are not actively processing audio
-                # for avoiding a ptt toggle state bug
-                if self.audio_out_queue.empty() and not self.enqueuing_audio:
-                    self.states.setTransmitting(False)
-                # Fill with zeros if the queue is empty
-                outdata.fill(0)
+    def sd_output_audio_callback(self, outdata: np.ndarray, frames: int, time, status) -> None:
+        """
+        Copy the next samples of the TX ring to the audio device, silence if there are none
+        """
+        try:
+            ring = self.tx_ring
+            if self.audio_out_cleared.is_set():
+                ring.pop(ring.nbuffer)
+            available = min(ring.nbuffer, frames)
+            if available:
+                outdata[:available, 0] = ring.buffer[:available]
+                ring.pop(available)
+                self.tx_space_event.set()
+                if self.tx_start is not None:
+                    self.update_time_to_first_sample()
+            outdata[available:] = 0
+
+            if available < frames and self.ptt_state:
+                if self.enqueuing_audio:
+                    # the next frame isn't modulated yet
+                    self.audio_output_statistics['underruns'] += 1
+                elif not self.tx_drained.is_set():
+                    # the last sample of the transmission is in this block
+                    dac_time = getattr(time, 'outputBufferDacTime', None)
+                    self.tx_last_sample_time = dac_time + available / self.tx_sample_rate if dac_time else None
+                    self.tx_drained.set()
         except Exception as e:
             self.log.warning("[AUDIO STATUS]", status=status, time=time, frames=frames, e=e)
             outdata.fill(0)
 
+    def update_time_to_first_sample(self) -> None:
+        statistics = self.audio_output_statistics
+        duration_ms = (perf_counter() - self.tx_start) * 1000
+        self.tx_start = None
+        statistics['transmissions'] += 1
+        statistics['time_to_first_sample_ms'] = duration_ms
+        statistics['time_to_first_sample_ms_mean'] += (
+            duration_ms - statistics['time_to_first_sample_ms_mean']
+        ) / statistics['transmissions']
+        statistics['time_to_first_sample_ms_max'] = max(statistics['time_to_first_sample_ms_max'], duration_ms)
+
     def sd_input_audio_callback(self, indata: np.ndarray, frames: int, time, status) -> None:
-            if status:
-                self.log.warning("[AUDIO STATUS]", status=status, time=time, frames=frames)
-                # FIXME on windows input overflows crashing the rx audio stream. Lets restart the server then
-                #if status.input_overflow:
-                #    self.service_queue.put("restart")
-                return
-            try:
-                audio_48k = np.frombuffer(indata, dtype=np.int16)
-                audio_8k = self.resampler.resample48_to_8(audio_48k)
-
-                audio_8k_level_adjusted = audio.set_audio_volume(audio_8k, self.rx_audio_level)
-
-                if not self.states.isTransmitting():
-                    audio.calculate_fft(audio_8k_level_adjusted, self.fft_queue, self.states)
-
-                length_audio_8k_level_adjusted = len(audio_8k_level_adjusted)
-                # Avoid buffer overflow by filling only if buffer for
-                # selected datachannel mode is not full
-                index = 0
-                for mode in self.demodulator.MODE_DICT:
-                    mode_data = self.demodulator.MODE_DICT[mode]
-                    audiobuffer = mode_data['audio_buffer']
-                    decode = mode_data['decode']
-                    index += 1
-                    if audiobuffer:
-                        if (audiobuffer.nbuffer + length_audio_8k_level_adjusted) > audiobuffer.size:
-                            self.demodulator.buffer_overflow_counter[index] += 1
-                            self.event_manager.send_buffer_overflow(self.demodulator.buffer_overflow_counter)
-                        elif decode:
-                            audiobuffer.push(audio_8k_level_adjusted)
-            except Exception as e:
-                self.log.warning("[AUDIO EXCEPTION]", status=status, time=time, frames=frames, e=e)
+        """
+        Copy the raw samples to the rx buffer and wake up the dsp thread,
+        everything else is done outside of the audio callback.
+        """
+        callback_start = perf_counter()
+        statistics = self.audio_input_statistics
+        if status and status.input_overflow:
+            statistics['input_overflows'] += 1
+
+        samples = np.frombuffer(indata, dtype=np.int16)
+        if self.rx_raw_buffer.nbuffer + len(samples) <= self.rx_raw_buffer.size:
+            self.rx_raw_buffer.push(samples)
+        else:
+            # the dsp thread isn't keeping up, so we have to drop the block
+            statistics['raw_buffer_overflows'] += 1
+        self.rx_dsp_event.set()
+
+        duration_ms = (perf_counter() - callback_start) * 1000
+        statistics['callbacks'] += 1
+        statistics['callback_ms_mean'] += (duration_ms - statistics['callback_ms_mean']) / statistics['callbacks']
+        statistics['callback_ms_max'] = max(statistics['callback_ms_max'], duration_ms)
+
+    def rx_dsp_worker(self) -> None:
+        """
+        Re-sample, level adjust and distribute the raw input audio to the decoders and the fft
+        """
+        raw_buffer = self.rx_raw_buffer
+        statistics = self.audio_input_statistics
+        last_input_overflows = 0
+        while not self.rx_dsp_stop.is_set():
+            self.rx_dsp_event.wait(1)
+            self.rx_dsp_event.clear()
+
+            if statistics['input_overflows'] != last_input_overflows:
+                last_input_overflows = statistics['input_overflows']
+                self.log.warning("[AUDIO STATUS] input overflow", input_overflows=last_input_overflows)
+
+            while raw_buffer.nbuffer >= self.rx_blocksize and not self.rx_dsp_stop.is_set():
+                try:
+                    self.process_rx_audio(raw_buffer.buffer[:self.rx_blocksize])
+                except Exception as e:
+                    self.log.warning("[AUDIO EXCEPTION]", e=e)
+                raw_buffer.pop(self.rx_blocksize)
+
+    def process_rx_audio(self, samples: np.ndarray) -> None:
+        if self.rx_sample_rate == self.modem_sample_rate:
+            audio_8k = samples
+        else:
+            audio_8k = self.rx_resampler.resample48_to_8(samples, self.rx_audio_8k)
+
+        audio_8k_level_adjusted = self.rx_gain.apply(audio_8k)
+
+        self.demodulator.push_audio(audio_8k_level_adjusted)
+
+        self.fft_samples += len(audio_8k_level_adjusted)
+        if self.fft_samples >= self.fft_interval:
+            self.fft_samples = 0
+            if not self.states.isTransmitting():
+                audio.calculate_fft(
+                    self.demodulator.rx_history.latest(self.fft_length), self.fft_queue, self.states
+                )
+            else:
+                tx_audio = self.get_tx_spectrum_window()
+                if tx_audio is not None:
+                    audio.calculate_fft(tx_audio, self.fft_queue, self.states)
+
+    def get_tx_spectrum_window(self):
+        """
+        The 8 kHz TX signal, which has been played last
+
+        Returns:
+            np.int16 view of fft_length samples, None if there is no 8 kHz signal
+        """
+        if self.tx_ring is None:
+            return None
+        ring_start, history_start = self.tx_history_start
+        ratio = self.tx_sample_rate // self.modem_sample_rate
+        end = history_start + (self.tx_ring.read_count - ring_start) // ratio
+        start = end - self.fft_length
+        if start < history_start or end > self.tx_history.write_count:
+            return None
+        offset = start % self.tx_history.size
+        return self.tx_history.mirror[offset:offset + self.fft_length]
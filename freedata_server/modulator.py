@@ -1,8 +1,182 @@
+import collections
 import ctypes
+import threading
 import codec2
+from config import CONFIG
+import numpy as np
 import structlog
 
 
+class WaveformCache:
+    """
+    Preamble and postamble of each mode with TX gain applied, at 8 kHz and
+    re-sampled to the sample rate of the audio output. They are the same for
+    every frame, so they are only re-sampled once. Silence doesn't need a
+    cache, bursts are assembled in zeroed arrays.
+    """
+
+    def __init__(self):
+        self.waveforms = {}
+        self.generation = codec2.ofdm_configuration_generation
+        self.statistics = {'hits': 0, 'misses': 0}
+
+    def get(self, mode, gain, sample_rate, preamble, postamble) -> dict:
+        """
+        Waveforms of the modulated 8 kHz preamble and postamble, which are only re-sampled on a miss
+        """
+        generation = codec2.ofdm_configuration_generation
+        # OFDM configurations have changed, so the custom modes might sound different now
+        if self.generation != generation:
+            self.waveforms = {key: waveforms for key, waveforms in self.waveforms.items() if key[0] == generation}
+            self.generation = generation
+
+        key = (generation, mode.value, gain.factor, sample_rate)
+        if key in self.waveforms:
+            self.statistics['hits'] += 1
+            return self.waveforms[key]
+        self.statistics['misses'] += 1
+
+        waveforms = {}
+        for name, samples in [("preamble", preamble), ("postamble", postamble)]:
+            samples = gain.apply(samples)
+            waveforms[name + "8"] = samples
+            # re-sampled as if preceded by silence, the first samples are fixed up per burst
+            waveforms[name] = codec2.streaming_resampler(len(samples) * codec2.api.FDMDV_OS_48).resample8_to_48(samples)
+        self.waveforms[key] = waveforms
+        return waveforms
+
+
+class PieceCache:
+    """
+    Modulated 8 kHz pieces of the bursts, so pieces which have been sent
+    before are copied instead of being modulated by codec2 again
+
+    The first samples of a modulated piece depend on the piece the codec2
+    instance has modulated before. In a burst a preamble always follows a
+    postamble, a frame follows a preamble and a postamble follows its frame.
+    So each mode has one preamble, and postambles are kept together with the
+    frame they follow. On a miss the preceding piece is modulated first, so
+    the cached pieces don't depend on what the instance did before. Frames
+    are bounded by max_bytes.
+    """
+
+    def __init__(self, modulator, max_bytes):
+        self.modulator = modulator
+        self.preambles = {}
+        self.frames = BurstCache(max_bytes)
+        self.generation = codec2.ofdm_configuration_generation
+        self.lock = threading.Lock()
+        self.statistics = self.frames.statistics
+
+    def get_preamble(self, mode, geometry) -> np.ndarray:
+        generation = codec2.ofdm_configuration_generation
+        if self.generation != generation:
+            self.preambles = {key: preamble for key, preamble in self.preambles.items() if key[0] == generation}
+            self.generation = generation
+
+        key = (generation, mode.value)
+        preamble = self.preambles.get(key)
+        if preamble is not None:
+            return preamble
+
+        preamble = np.zeros(geometry["n_tx_preamble_modem_samples"], dtype=np.int16)
+        postamble = np.zeros(geometry["n_tx_postamble_modem_samples"], dtype=np.int16)
+        with self.lock:
+            freedv = codec2.instances.get(mode.value, "tx")
+            try:
+                self.modulator.write_postamble(postamble, freedv, geometry)
+                self.modulator.write_preamble(preamble, freedv, geometry)
+            finally:
+                codec2.instances.release(mode.value, "tx")
+        preamble.flags.writeable = False
+        self.preambles[key] = preamble
+        return preamble
+
+    def get_frame(self, mode, frame, geometry) -> tuple:
+        """
+        The modulated frame and the postamble following it
+        """
+        key = (mode.value, bytes(frame))
+        pieces = self.frames.get(key)
+        if pieces is not None:
+            return pieces
+
+        preamble = np.zeros(geometry["n_tx_preamble_modem_samples"], dtype=np.int16)
+        samples = np.zeros(geometry["n_tx_modem_samples"], dtype=np.int16)
+        postamble = np.zeros(geometry["n_tx_postamble_modem_samples"], dtype=np.int16)
+        with self.lock:
+            freedv = codec2.instances.get(mode.value, "tx")
+            try:
+                self.modulator.write_preamble(preamble, freedv, geometry)
+                self.modulator.write_frame(samples, freedv, frame, geometry)
+                self.modulator.write_postamble(postamble, freedv, geometry)
+            finally:
+                codec2.instances.release(mode.value, "tx")
+        self.frames.put(key, samples, postamble)
+        return samples, postamble
+
+
+class BurstCache:
+    """
+    LRU cache of complete bursts at the sample rate of the audio output,
+    together with the 8 kHz signal they have been re-sampled from
+
+    Beacons, CQ, QRV and retried frames are sent with the same bytes again
+    and again, so they are only modulated once. Cached bursts are read-only
+    and the cache is bounded by max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bursts = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = codec2.ofdm_configuration_generation
+        self.statistics = {'hits': 0, 'misses': 0, 'evicted': 0, 'entries': 0, 'bytes': 0}
+
+    def get(self, key):
+        with self.lock:
+            if self.generation != codec2.ofdm_configuration_generation:
+                self.clear()
+                self.generation = codec2.ofdm_configuration_generation
+            burst = self.bursts.get(key)
+            if burst is None:
+                self.statistics['misses'] += 1
+                return None
+            self.bursts.move_to_end(key)
+            self.statistics['hits'] += 1
+            return burst
+
+    def put(self, key, burst, burst8=None):
+        """
+        Keep a burst and its 8 kHz signal, which is the burst itself if burst8 is None
+        """
+        burst8 = burst if burst8 is None else burst8
+        nbytes = self.get_size(burst, burst8)
+        if nbytes > self.max_bytes:
+            return
+        burst.flags.writeable = False
+        burst8.flags.writeable = False
+        with self.lock:
+            if key in self.bursts:
+                self.statistics['bytes'] -= self.get_size(*self.bursts.pop(key))
+            self.bursts[key] = (burst, burst8)
+            self.statistics['bytes'] += nbytes
+            while self.statistics['bytes'] > self.max_bytes:
+                _, evicted = self.bursts.popitem(last=False)
+                self.statistics['bytes'] -= self.get_size(*evicted)
+                self.statistics['evicted'] += 1
+            self.statistics['entries'] = len(self.bursts)
+
+    @staticmethod
+    def get_size(burst, burst8) -> int:
+        return burst.nbytes if burst8 is burst else burst.nbytes + burst8.nbytes
+
+    def clear(self):
+        self.bursts.clear()
+        self.statistics['entries'] = 0
+        self.statistics['bytes'] = 0
+
+
 class Modulator:
     log = structlog.get_logger("RF")
 
@@ -10,65 +184,38 @@ class Modulator:
         self.config = config
         self.tx_delay = config['MODEM']['tx_delay']
         self.modem_sample_rate = codec2.api.FREEDV_FS_8000
+        self.waveform_cache = WaveformCache()
+        tx_burst_cache_mb = config['MODEM'].get('tx_burst_cache_mb', 0)
+        if tx_burst_cache_mb <= 0:
+            tx_burst_cache_mb = CONFIG.setting_defaults['MODEM']['tx_burst_cache_mb']
+        self.burst_cache = BurstCache(tx_burst_cache_mb * 1024 * 1024)
+        # 8 kHz pieces are a sixth of the size of the re-sampled bursts
+        self.piece_cache = PieceCache(self, self.burst_cache.max_bytes // 4)
 
-        # Initialize codec2, rig control, and data threads
-        self.init_codec2()
-
-    def init_codec2(self):
-        # Open codec2 instances
-
-        # INIT TX MODES - here we need all modes.
-        self.freedv_datac0_tx = codec2.open_instance(codec2.FREEDV_MODE.datac0.value)
-        self.freedv_datac1_tx = codec2.open_instance(codec2.FREEDV_MODE.datac1.value)
-        self.freedv_datac3_tx = codec2.open_instance(codec2.FREEDV_MODE.datac3.value)
-        self.freedv_datac4_tx = codec2.open_instance(codec2.FREEDV_MODE.datac4.value)
-        self.freedv_datac13_tx = codec2.open_instance(codec2.FREEDV_MODE.datac13.value)
-        self.freedv_datac14_tx = codec2.open_instance(codec2.FREEDV_MODE.datac14.value)
-        self.data_ofdm_500_tx = codec2.open_instance(codec2.FREEDV_MODE.data_ofdm_500.value)
-        self.data_ofdm_2438_tx = codec2.open_instance(codec2.FREEDV_MODE.data_ofdm_2438.value)
-        #self.freedv_qam16c2_tx = codec2.open_instance(codec2.FREEDV_MODE.qam16c2.value)
-        #self.data_qam_2438_tx = codec2.open_instance(codec2.FREEDV_MODE.data_qam_2438.value)
-
-    def transmit_add_preamble(self, buffer, freedv):
-        # Init buffer for preample
-        n_tx_preamble_modem_samples = codec2.api.freedv_get_n_tx_preamble_modem_samples(
-            freedv
-        )
-        mod_out_preamble = ctypes.create_string_buffer(n_tx_preamble_modem_samples * 2)
+        # TX instances are opened on first use by codec2.instances
 
-        # Write preamble to txbuffer
-        codec2.api.freedv_rawdatapreambletx(freedv, mod_out_preamble)
-        buffer += bytes(mod_out_preamble)
-        return buffer
-
-    def transmit_add_postamble(self, buffer, freedv):
-        # Init buffer for postamble
-        n_tx_postamble_modem_samples = (
-            codec2.api.freedv_get_n_tx_postamble_modem_samples(freedv)
-        )
-        mod_out_postamble = ctypes.create_string_buffer(
-            n_tx_postamble_modem_samples * 2
-        )
-        # Write postamble to txbuffer
-        codec2.api.freedv_rawdatapostambletx(freedv, mod_out_postamble)
-        # Append postamble to txbuffer
-        buffer += bytes(mod_out_postamble)
-        return buffer
+    def write_preamble(self, out, freedv, geometry=None) -> int:
+        """
+        Modulate the preamble into the int16 array out, returns the number of samples
+        """
+        # custom instances don't have a cached geometry
+        geometry = geometry or codec2.read_geometry(freedv)
+        n_tx_preamble_modem_samples = geometry["n_tx_preamble_modem_samples"]
+        codec2.api.freedv_rawdatapreambletx(freedv, out[:n_tx_preamble_modem_samples].ctypes)
+        return n_tx_preamble_modem_samples
 
-    def transmit_add_silence(self, buffer, duration):
-        data_delay = int(self.modem_sample_rate * (duration / 1000))  # type: ignore
-        mod_out_silence = ctypes.create_string_buffer(data_delay * 2)
-        buffer += bytes(mod_out_silence)
-        return buffer
+    def write_postamble(self, out, freedv, geometry=None) -> int:
+        geometry = geometry or codec2.read_geometry(freedv)
+        n_tx_postamble_modem_samples = geometry["n_tx_postamble_modem_samples"]
+        codec2.api.freedv_rawdatapostambletx(freedv, out[:n_tx_postamble_modem_samples].ctypes)
+        return n_tx_postamble_modem_samples
 
-    def transmit_create_frame(self, txbuffer, freedv, frame):
+    def write_frame(self, out, freedv, frame, geometry=None) -> int:
+        geometry = geometry or codec2.read_geometry(freedv)
         # Get number of bytes per frame for mode
-        bytes_per_frame = int(codec2.api.freedv_get_bits_per_modem_frame(freedv) / 8)
-        payload_bytes_per_frame = bytes_per_frame - 2
-        #print(payload_bytes_per_frame)
-        # Init buffer for data
-        n_tx_modem_samples = codec2.api.freedv_get_n_tx_modem_samples(freedv)
-        mod_out = ctypes.create_string_buffer(n_tx_modem_samples * 2)
+        bytes_per_frame = geometry["bytes_per_frame"]
+        payload_bytes_per_frame = geometry["payload_bytes_per_frame"]
+        n_tx_modem_samples = geometry["n_tx_modem_samples"]
 
         # Create buffer for data
         # Use this if CRC16 checksum is required (DATAc1-3)
@@ -88,16 +235,58 @@ class Modulator:
         # Append CRC to data buffer
         buffer += crc
         assert (bytes_per_frame == len(buffer))
-        data = (ctypes.c_ubyte * bytes_per_frame).from_buffer_copy(buffer)
-        # modulate DATA and save it into mod_out pointer
-        codec2.api.freedv_rawdatatx(freedv, mod_out, data)
-        txbuffer += bytes(mod_out)
+        data = (ctypes.c_ubyte * bytes_per_frame).from_buffer(buffer)
+        # modulate DATA directly into the output array
+        codec2.api.freedv_rawdatatx(freedv, out[:n_tx_modem_samples].ctypes, data)
+        return n_tx_modem_samples
+
+    def get_silence_samples(self, duration) -> int:
+        return int(self.modem_sample_rate * (duration / 1000))  # type: ignore
+
+    def get_burst_samples(self, geometry, frame_count: int, repeats: int, repeat_delay: int) -> int:
+        """
+        Exact number of samples of a burst
+        """
+        frame_samples = (
+            geometry["n_tx_preamble_modem_samples"]
+            + geometry["n_tx_modem_samples"]
+            + geometry["n_tx_postamble_modem_samples"]
+        )
+        silence = self.get_silence_samples(self.tx_delay) if self.tx_delay > 0 else 0
+        return silence + repeats * (frame_count * frame_samples + self.get_silence_samples(repeat_delay))
+
+    # bytes based helpers, used by the custom mode tools
+
+    def transmit_add_preamble(self, buffer, freedv, geometry=None):
+        geometry = geometry or codec2.read_geometry(freedv)
+        out = np.zeros(geometry["n_tx_preamble_modem_samples"], dtype=np.int16)
+        self.write_preamble(out, freedv, geometry)
+        buffer += out.tobytes()
+        return buffer
+
+    def transmit_add_postamble(self, buffer, freedv, geometry=None):
+        geometry = geometry or codec2.read_geometry(freedv)
+        out = np.zeros(geometry["n_tx_postamble_modem_samples"], dtype=np.int16)
+        self.write_postamble(out, freedv, geometry)
+        buffer += out.tobytes()
+        return buffer
+
+    def transmit_add_silence(self, buffer, duration):
+        buffer += bytes(self.get_silence_samples(duration) * 2)
+        return buffer
+
+    def transmit_create_frame(self, txbuffer, freedv, frame, geometry=None):
+        geometry = geometry or codec2.read_geometry(freedv)
+        out = np.zeros(geometry["n_tx_modem_samples"], dtype=np.int16)
+        self.write_frame(out, freedv, frame, geometry)
+        txbuffer += out.tobytes()
         return txbuffer
 
     def create_burst(
             self, mode, repeats: int, repeat_delay: int, frames: bytearray
-    ) -> bool:
+    ) -> np.ndarray:
         """
+        Modulate a burst into a single int16 array, which is allocated once
 
         Args:
           mode:
@@ -105,57 +294,224 @@ class Modulator:
           repeat_delay:
           frames:
 
+        Returns:
+            8 kHz audio as np.int16
         """
 
-
-
         # get freedv instance by mode
-        mode_transition = {
-            codec2.FREEDV_MODE.signalling_ack: self.freedv_datac14_tx,
-            codec2.FREEDV_MODE.signalling: self.freedv_datac13_tx,
-            codec2.FREEDV_MODE.datac0: self.freedv_datac0_tx,
-            codec2.FREEDV_MODE.datac1: self.freedv_datac1_tx,
-            codec2.FREEDV_MODE.datac3: self.freedv_datac3_tx,
-            codec2.FREEDV_MODE.datac4: self.freedv_datac4_tx,
-            codec2.FREEDV_MODE.datac13: self.freedv_datac13_tx,
-            codec2.FREEDV_MODE.datac14: self.freedv_datac14_tx,
-            codec2.FREEDV_MODE.data_ofdm_500: self.data_ofdm_500_tx,
-            codec2.FREEDV_MODE.data_ofdm_2438: self.data_ofdm_2438_tx,
-            #codec2.FREEDV_MODE.qam16c2: self.freedv_qam16c2_tx,
-            #codec2.FREEDV_MODE.data_qam_2438: self.freedv_data_qam_2438_tx,
-        }
-        if mode in mode_transition:
-            freedv = mode_transition[mode]
-        else:
-            print("wrong mode.................")
-            print(mode)
-            #return False
-
-
-        # Open codec2 instance
         self.MODE = mode
         self.log.debug(
             "[MDM] TRANSMIT", mode=self.MODE.name, delay=self.tx_delay
         )
 
-        txbuffer = bytes()
-
+        if not isinstance(frames, list): frames = [frames]
+        geometry = codec2.mode_geometry(mode.value)
+        # silence is already in place
+        txbuffer = np.zeros(self.get_burst_samples(geometry, len(frames), repeats, repeat_delay), dtype=np.int16)
 
         # Add empty data to handle ptt toggle time
-        if self.tx_delay > 0:
-            txbuffer = self.transmit_add_silence(txbuffer, self.tx_delay)
+        position = self.get_silence_samples(self.tx_delay) if self.tx_delay > 0 else 0
+
+        freedv = codec2.instances.get(mode.value, "tx")
+        try:
+            for _ in range(repeats):
+
+                # Create modulation for all frames in the list
+                for frame in frames:
+                    position += self.write_preamble(txbuffer[position:], freedv, geometry)
+                    position += self.write_frame(txbuffer[position:], freedv, frame, geometry)
+                    position += self.write_postamble(txbuffer[position:], freedv, geometry)
+
+                # Add delay to end of frames
+                position += self.get_silence_samples(repeat_delay)
+        finally:
+            codec2.instances.release(mode.value, "tx")
+
+        assert position == len(txbuffer)
+        return txbuffer
+
+    def burst_cache_key(self, mode, repeats: int, repeat_delay: int, frames, gain, sample_rate: int) -> tuple:
+        return (
+            mode.value, tuple(bytes(frame) for frame in frames),
+            repeats, repeat_delay, self.tx_delay, gain.factor, sample_rate
+        )
+
+    def get_output_burst(
+            self, mode, repeats: int, repeat_delay: int, frames, gain, sample_rate: int, resampler=None
+    ) -> np.ndarray:
+        """
+        Create a burst with TX gain applied at the sample rate of the audio output
 
+        Re-sampled preamble and postamble are copied from the waveform cache,
+        only the frames and the first samples of each piece are re-sampled. The
+        result is the same as re-sampling the gained output of create_burst at
+        once. Bursts which have been sent before are taken from the burst cache.
+
+        Args:
+          mode:
+          repeats:
+          repeat_delay:
+          frames:
+          gain: audio.GainStage of the TX path
+          sample_rate: 8000 or 48000
+          resampler: codec2.streaming_resampler, needed for 48000
+
+        Returns:
+            audio as np.int16, read-only
+        """
         if not isinstance(frames, list): frames = [frames]
-        for _ in range(repeats):
+        key = self.burst_cache_key(mode, repeats, repeat_delay, frames, gain, sample_rate)
+        cached = self.burst_cache.get(key)
+        if cached is not None:
+            self.log.debug("[MDM] TRANSMIT cached burst", mode=mode.name)
+            return cached[0]
+        burst, burst8 = self.allocate_output_burst(mode, repeats, repeat_delay, frames, sample_rate)
+        for _ in self.write_output_burst(burst, mode, repeats, repeat_delay, frames, gain, sample_rate, resampler, burst8):
+            pass
+        self.burst_cache.put(key, burst, burst8)
+        return burst
+
+    def stream_output_burst(
+            self, mode, repeats: int, repeat_delay: int, frames, gain, sample_rate: int, resampler=None
+    ):
+        """
+        Yield a burst at the sample rate of the audio output piece by piece
+
+        The next frame is only modulated when the audio of the previous one has
+        been taken, so transmitting can start right away. Bursts which have been
+        sent before are taken from the burst cache at once.
+
+        Yields:
+            (audio, audio_8k) as np.int16, consecutive views of the complete
+            burst and of the 8 kHz signal it has been re-sampled from
+        """
+        if not isinstance(frames, list): frames = [frames]
+        key = self.burst_cache_key(mode, repeats, repeat_delay, frames, gain, sample_rate)
+        cached = self.burst_cache.get(key)
+        if cached is not None:
+            self.log.debug("[MDM] TRANSMIT cached burst", mode=mode.name)
+            yield cached
+            return
+
+        ratio = sample_rate // self.modem_sample_rate
+        burst, burst8 = self.allocate_output_burst(mode, repeats, repeat_delay, frames, sample_rate)
+        start = 0
+        for end in self.write_output_burst(burst, mode, repeats, repeat_delay, frames, gain, sample_rate, resampler, burst8):
+            if end > start:
+                yield burst[start:end], burst8[start // ratio:end // ratio]
+            start = end
+        self.burst_cache.put(key, burst, burst8)
+
+    def allocate_output_burst(self, mode, repeats: int, repeat_delay: int, frames: list, sample_rate: int) -> tuple:
+        """
+        Zeroed arrays for a burst at sample_rate and for its 8 kHz signal, which are the same at 8 kHz
+        """
+        geometry = codec2.mode_geometry(mode.value)
+        samples = self.get_burst_samples(geometry, len(frames), repeats, repeat_delay)
+        # silence is already in place
+        if sample_rate == self.modem_sample_rate:
+            burst = np.zeros(samples, dtype=np.int16)
+            return burst, burst
+        return np.zeros(samples * (sample_rate // self.modem_sample_rate), dtype=np.int16), np.zeros(samples, dtype=np.int16)
+
+    def write_output_burst(
+            self, out, mode, repeats: int, repeat_delay: int, frames: list, gain, sample_rate: int, resampler, out8=None
+    ):
+        """
+        Modulate and re-sample a burst into out piece by piece, yields the end of the written samples
+
+        The modulated pieces are taken from the piece cache. The gained 8 kHz
+        pieces are written to out8 as well, if given.
+        """
+        self.MODE = mode
+        self.log.debug(
+            "[MDM] TRANSMIT", mode=self.MODE.name, delay=self.tx_delay
+        )
+
+        geometry = codec2.mode_geometry(mode.value)
+        ratio = sample_rate // self.modem_sample_rate
+        burst = BurstWriter(out, ratio, resampler)
+
+        # Add empty data to handle ptt toggle time
+        burst.add_silence(self.get_silence_samples(self.tx_delay) if self.tx_delay > 0 else 0)
+        yield burst.position
 
-            # Create modulation for all frames in the list
+        preamble = self.piece_cache.get_preamble(mode, geometry)
+        waveforms = {}
+        for _ in range(repeats):
             for frame in frames:
-                txbuffer = self.transmit_add_preamble(txbuffer, freedv)
-                txbuffer = self.transmit_create_frame(txbuffer, freedv, frame)
-                txbuffer = self.transmit_add_postamble(txbuffer, freedv)
+                samples, postamble = self.piece_cache.get_frame(mode, frame, geometry)
+                if ratio != 1 and not waveforms:
+                    waveforms = self.waveform_cache.get(mode, gain, sample_rate, preamble, postamble)
+                for samples8, name in [(preamble, "preamble"), (samples, None), (postamble, "postamble")]:
+                    piece = gain.apply(samples8)
+                    if out8 is not None and out8 is not out:
+                        position8 = burst.position // ratio
+                        out8[position8:position8 + len(piece)] = piece
+                    if name is None or ratio == 1:
+                        burst.add(piece)
+                    else:
+                        burst.add(piece, waveforms[name + "8"], waveforms[name])
+                yield burst.position
 
             # Add delay to end of frames
-            txbuffer = self.transmit_add_silence(txbuffer, repeat_delay)
+            burst.add_silence(self.get_silence_samples(repeat_delay))
+            yield burst.position
 
-        return txbuffer
+        assert burst.position == len(out)
+
+
+class BurstWriter:
+    """
+    Re-sample the 8 kHz pieces of a burst into an output array
+
+    Pieces re-sampled in advance have been filtered as if preceded by silence,
+    and the first samples of a modulated piece depend on the TX filter state of
+    the codec2 instance. So the cached output is only used from where the piece
+    matches the cached piece, the samples before are re-sampled again with the
+    actual preceding samples. Joining the pieces gives the same result as
+    re-sampling the whole burst.
+    """
+
+    def __init__(self, out, ratio, resampler):
+        self.out = out
+        self.ratio = ratio
+        self.resampler = resampler
+        self.position = 0
+        # last 8 kHz samples written, the filter memory of the next piece
+        self.history = np.zeros(codec2.streaming_resampler.MEM8, dtype=np.int16)
+
+    def add(self, samples8, cached8=None, cached=None):
+        n8 = len(samples8)
+        if self.ratio == 1:
+            self.out[self.position:self.position + n8] = samples8
+            self.position += n8
+            return
+        if n8 == 0:
+            return
+        head = n8
+        if cached8 is not None and len(cached8) == n8:
+            differences = np.flatnonzero(samples8 != cached8)
+            matching = differences[-1] + 1 if len(differences) else 0
+            head = min(n8, matching + len(self.history))
+        self.resample(samples8[:head])
+        if head < n8:
+            self.out[self.position + head * self.ratio:self.position + n8 * self.ratio] = cached[head * self.ratio:]
+        self.position += n8 * self.ratio
+        self.update_history(samples8)
+
+    def add_silence(self, n8):
+        if n8 == 0:
+            return
+        # the output array is zeroed already, only the filter response of the preceding samples is missing
+        if self.ratio != 1 and self.history.any():
+            self.resample(np.zeros(min(n8, len(self.history)), dtype=np.int16))
+        self.position += n8 * self.ratio
+        self.update_history(np.zeros(min(n8, len(self.history)), dtype=np.int16))
+
+    def resample(self, samples8):
+        self.resampler.set_history8(self.history)
+        self.resampler.resample8_to_48(samples8, self.out[self.position:self.position + len(samples8) * self.ratio])
 
+    def update_history(self, samples8):
+        self.history = np.concatenate((self.history, samples8[-len(self.history):]))[-len(self.history):]
@@ -2,6 +2,8 @@
 Hold queues used by more than one module to eliminate cyclic imports.
 """
 import queue
+import threading
+import time
 
 # Initialize FIFO queue to store received frames
 MESH_RECEIVED_QUEUE = queue.Queue()
@@ -9,4 +11,62 @@ MESH_QUEUE_TRANSMIT = queue.Queue()
 MESH_SIGNALLING_TABLE = []
 
 # Commands we want to send to rigctld
-RIGCTLD_COMMAND_QUEUE = queue.Queue()
\ No newline at end of file
+RIGCTLD_COMMAND_QUEUE = queue.Queue()
+
+class LatestValueMailbox:
+    """
+    Single slot queue for streams where only the newest value matters, like
+    the fft. A put overwrites a value which hasn't been taken yet, so the
+    mailbox never backs up. get() hands out values at max_rate per second at most.
+    """
+
+    def __init__(self, max_rate: float = 0):
+        self.condition = threading.Condition()
+        self.value = None
+        self.full = False
+        self.min_interval = 1 / max_rate if max_rate > 0 else 0
+        self.last_get = 0
+        self.statistics = {'published': 0, 'dropped': 0}
+
+    def put(self, value) -> None:
+        with self.condition:
+            if self.full:
+                self.statistics['dropped'] += 1
+            self.value = value
+            self.full = True
+            self.condition.notify()
+
+    def get(self, block=True, timeout=None):
+        """
+        Take the newest value, same semantics as queue.Queue.get
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # limit the rate values are taken with, the slot stays full meanwhile
+        delay = self.last_get + self.min_interval - time.monotonic()
+        if block and delay > 0:
+            if deadline is not None and time.monotonic() + delay > deadline:
+                time.sleep(max(deadline - time.monotonic(), 0))
+                raise queue.Empty
+            time.sleep(delay)
+
+        with self.condition:
+            if block and not self.full:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                self.condition.wait_for(lambda: self.full, remaining)
+            if not self.full:
+                raise queue.Empty
+            value = self.value
+            self.value = None
+            self.full = False
+            self.last_get = time.monotonic()
+            self.statistics['published'] += 1
+            return value
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def empty(self) -> bool:
+        return not self.full
+
+    def qsize(self) -> int:
+        return int(self.full)
@@ -8,6 +8,7 @@ from message_system_db_messages import DatabaseManagerMessages
 from message_system_db_beacon import DatabaseManagerBeacon
 import explorer
 import command_beacon
+import codec2
 import atexit
 import numpy as np
 import structlog
@@ -31,6 +32,7 @@ class ScheduleManager:
             'transmitting_beacon': {'function': self.transmit_beacon, 'interval': 600},
             'beacon_cleanup': {'function': self.delete_beacons, 'interval': 600},
             'update_transmission_state': {'function': self.update_transmission_state, 'interval': 10},
+            'codec2_instance_cleanup': {'function': self.close_idle_codec2_instances, 'interval': 10},
         }
         self.running = False  # Flag to control the running state
         self.scheduler_thread = None  # Reference to the scheduler thread
@@ -87,6 +89,15 @@ class ScheduleManager:
         except Exception as e:
             print(e)
 
+    def close_idle_codec2_instances(self):
+        try:
+            idle_timeout = self.config['MODEM'].get('codec2_instance_idle_timeout', 0)
+            if idle_timeout <= 0:
+                idle_timeout = self.config_manager.setting_defaults['MODEM']['codec2_instance_idle_timeout']
+            codec2.instances.close_idle(idle_timeout)
+        except Exception as e:
+            print(e)
+
     def push_to_explorer(self):
         self.config = self.config_manager.read()
         if self.config['STATION']['enable_explorer'] and self.state_manager.is_modem_running:
@@ -19,6 +19,7 @@ import threading
 import serial_ports
 from config import CONFIG
 import audio
+import queues
 import service_manager
 import state_manager
 import websocket_manager
@@ -413,7 +414,7 @@ async def set_station_info(callsign: str, request: Request):
 @app.websocket("/events")
 async def websocket_events(websocket: WebSocket):
     await websocket.accept()
-    await app.wsm.handle_connection(websocket, app.wsm.events_client_list, app.modem_events)
+    await app.wsm.handle_connection(websocket, app.wsm.events_client_list, app.modem_events, app.event_manager)
 
 @app.websocket("/fft")
 async def websocket_fft(websocket: WebSocket):
@@ -486,17 +487,31 @@ def main():
     app.config_manager = CONFIG(config_file)
     app.p2p_data_queue = queue.Queue()
     app.state_queue = queue.Queue()
-    app.modem_events = queue.Queue()
-    app.modem_fft = queue.Queue()
+    # events of a client which is falling behind are handled by the retention rules
+    gui_config = app.config_manager.read()['GUI']
+    event_queue_size = gui_config.get('event_queue_size', 0)
+    if event_queue_size <= 0:
+        event_queue_size = app.config_manager.setting_defaults['GUI']['event_queue_size']
+    app.modem_events = event_manager.EventQueue(
+        maxsize=event_queue_size, retention=event_manager.parse_retention(gui_config.get('event_retention', []))
+    )
+    # the waterfall only needs the newest spectrum
+    fft_max_rate = app.config_manager.read()['MODEM'].get('fft_max_rate', 0)
+    if fft_max_rate <= 0:
+        fft_max_rate = app.config_manager.setting_defaults['MODEM']['fft_max_rate']
+    app.modem_fft = queues.LatestValueMailbox(fft_max_rate)
     app.modem_service = queue.Queue()
     app.event_manager = event_manager.EventManager([app.modem_events])
     app.state_manager = state_manager.StateManager(app.state_queue)
+    app.state_manager.register_modem_statistics("fft", app.modem_fft.statistics)
+    app.state_manager.register_modem_statistics("events", app.modem_events.statistics)
     app.schedule_manager = ScheduleManager(app.MODEM_VERSION, app.config_manager, app.state_manager, app.event_manager)
     app.service_manager = service_manager.SM(app)
     app.modem_service.put("start")
     DatabaseManager(app.event_manager).initialize_default_values()
     DatabaseManager(app.event_manager).database_repair_and_cleanup()
     app.wsm = websocket_manager.wsm()
+    app.state_manager.register_modem_statistics("websocket", app.wsm.statistics)
     app.wsm.startWorkerThreads(app)
 
     conf = app.config_manager.read()
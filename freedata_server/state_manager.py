@@ -54,6 +54,9 @@ class StateManager:
         # Set rig control status regardless or rig control method
         self.radio_status = False
 
+        # live counters published by modem components, only sent with full state requests
+        self.modem_statistics = {}
+
     def sendState(self):
         currentState = self.get_state_event(False)
         self.statequeue.put(currentState)
@@ -93,7 +96,7 @@ class StateManager:
         if (not isChangedState):
             msgtype = "state"
 
-        return {
+        state = {
             "type": msgtype,
             "is_modem_running": self.is_modem_running,
             "is_beacon_running": self.is_beacon_running,
@@ -105,6 +108,14 @@ class StateManager:
             "activities": self.activities_list,
             "is_modem_busy" : self.getARQ()
         }
+        # counters are changing all the time, so we are only adding them to full state requests
+        if not isChangedState:
+            state["modem_statistics"] = self.modem_statistics
+        return state
+
+    def register_modem_statistics(self, name, statistics: dict):
+        # statistics dicts are updated in place by their owners
+        self.modem_statistics[name] = statistics
 
     def get_radio_event(self, isChangedState):
         msgtype = "radio-change"
@@ -1,8 +1,39 @@
 import threading
 import json
 import asyncio
+import struct
+import numpy as np
 import structlog
 
+# binary frames: type (uint8), reserved (uint8), number of values (uint16), values
+BINARY_HEADER = struct.Struct('<BBH')
+BINARY_FFT = 1  # uint8 dB values
+BINARY_SCATTER = 2  # int16 x and y values
+
+# messages waiting for a client, before we are dropping the oldest
+CLIENT_QUEUE_SIZE = 64
+# a client which hasn't taken any of these messages is closed
+SLOW_CLIENT_DROP_LIMIT = 512
+
+
+def encode_binary(event):
+    """
+    Encode fft and scatter events as binary frame
+
+    Returns:
+        bytes, None if the event has no binary form
+    """
+    if isinstance(event, list):
+        frame_type = BINARY_FFT
+        values = np.clip(event, 0, 255).astype(np.uint8)
+    elif isinstance(event, dict) and list(event) == ["scatter"]:
+        frame_type = BINARY_SCATTER
+        values = np.asarray(event["scatter"], dtype='<i2')
+    else:
+        return None
+    return BINARY_HEADER.pack(frame_type, 0, len(values)) + values.tobytes()
+
+
 
 class wsm:
     def __init__(self):
@@ -13,42 +44,130 @@ class wsm:
         self.events_client_list = set()
         self.fft_client_list = set()
         self.states_client_list = set()
+        # clients which have asked for binary fft and scatter frames
+        self.binary_clients = set()
+
+        # per client send queues, fed on the event loop of the server
+        self.loop = None
+        self.client_queues = {}
+        self.statistics = {'clients': 0, 'sent': 0, 'dropped': 0, 'slow_clients_closed': 0}
 
         self.events_thread = None
         self.states_thread = None
         self.fft_thread = None
         
-    async def handle_connection(self, websocket, client_list, event_queue):
+    async def handle_connection(self, websocket, client_list, event_queue, event_manager=None):
+        self.loop = asyncio.get_running_loop()
+        self.client_queues[websocket] = {
+            'queue': asyncio.Queue(CLIENT_QUEUE_SIZE),
+            'dropped': 0,
+        }
+        sender = asyncio.create_task(self.client_sender(websocket, client_list))
         client_list.add(websocket)
-        while not self.shutdown_flag.is_set():
-            try:
-                await websocket.receive_text()
-            except Exception as e:
-                self.log.warning(f"Client connection lost", e=e)
+        self.statistics['clients'] = len(self.client_queues)
+        try:
+            while not self.shutdown_flag.is_set():
                 try:
-                    client_list.remove(websocket)
-                except Exception as err:
-                    self.log.error(f"Error removing client from list", e=e, err=err)
-                break
+                    message = await websocket.receive_text()
+                except Exception as e:
+                    self.log.warning(f"Client connection lost", e=e)
+                    break
+                self.handle_client_message(websocket, message, event_manager)
+        finally:
+            sender.cancel()
+            self.remove_client(websocket, client_list)
+            if event_manager:
+                event_manager.unsubscribe(websocket)
+
+    def remove_client(self, websocket, client_list):
+        client_list.discard(websocket)
+        self.binary_clients.discard(websocket)
+        self.client_queues.pop(websocket, None)
+        self.statistics['clients'] = len(self.client_queues)
+
+    async def client_sender(self, websocket, client_list):
+        """
+        Send the queued messages of a client, so a slow client isn't holding up the others
+        """
+        client = self.client_queues[websocket]
+        try:
+            while True:
+                message = await client['queue'].get()
+                if isinstance(message, bytes):
+                    await websocket.send_bytes(message)
+                else:
+                    await websocket.send_text(message)
+                client['dropped'] = 0
+                self.statistics['sent'] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.log.warning("Sending to client failed", e=e)
+            self.remove_client(websocket, client_list)
+
+    def fan_out(self, client_list, json_event, binary_event):
+        """
+        Queue an already serialized event for all clients, runs on the event loop
+        """
+        for client in list(client_list):
+            send_queue = self.client_queues.get(client)
+            if send_queue is None:
+                continue
+            message = binary_event if binary_event and client in self.binary_clients else json_event
+            if message is None:
+                continue
+            if send_queue['queue'].full():
+                # drop the oldest message of a slow client
+                send_queue['queue'].get_nowait()
+                send_queue['dropped'] += 1
+                self.statistics['dropped'] += 1
+                if send_queue['dropped'] >= SLOW_CLIENT_DROP_LIMIT:
+                    # the client isn't reading at all, so we are closing it
+                    self.statistics['slow_clients_closed'] += 1
+                    self.remove_client(client, client_list)
+                    asyncio.ensure_future(client.close())
+                    continue
+            send_queue['queue'].put_nowait(message)
+
+    def handle_client_message(self, websocket, message, event_manager=None):
+        """
+        Handle {"subscribe": [topics]}, {"unsubscribe": [topics]} and
+        {"encoding": "binary" | "json"} messages of a client
+        """
+        try:
+            request = json.loads(message)
+            if event_manager and "subscribe" in request:
+                event_manager.subscribe(websocket, request["subscribe"])
+            if event_manager and "unsubscribe" in request:
+                event_manager.unsubscribe(websocket, request["unsubscribe"])
+            if request.get("encoding") == "binary":
+                self.binary_clients.add(websocket)
+            elif request.get("encoding") == "json":
+                self.binary_clients.discard(websocket)
+        except Exception as e:
+            self.log.warning("Invalid client message", message=message, e=e)
 
     def transmit_sock_data_worker(self, client_list, event_queue):
+        """
+        Serialize events of a queue once and hand them over to the event loop
+        """
         while not self.shutdown_flag.is_set():
             try:
                 event = event_queue.get(timeout=1)
+                clients = list(client_list)
+                if not event or not clients or self.loop is None:
+                    continue
 
-                if event:
+                binary_event = None
+                if any(client in self.binary_clients for client in clients):
+                    binary_event = encode_binary(event)
+                json_event = None
+                if binary_event is None or any(client not in self.binary_clients for client in clients):
                     json_event = json.dumps(event)
-                    clients = client_list.copy()
-                    for client in clients:
-                        try:
-                            asyncio.run(client.send_text(json_event))
-                        except Exception:
-                            client_list.remove(client)
+                self.loop.call_soon_threadsafe(self.fan_out, client_list, json_event, binary_event)
             except Exception:
                 continue
 
-
-
     def startWorkerThreads(self, app):
         self.events_thread = threading.Thread(target=self.transmit_sock_data_worker, daemon=True, args=(self.events_client_list, app.modem_events))
         self.events_thread.start()
@@ -0,0 +1,35 @@
+import sys
+sys.path.append('freedata_server')
+
+import unittest
+import numpy as np
+import audio
+
+
+class TestGainStage(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.samples = rng.integers(-3000, 3000, 800, dtype=np.int16)
+
+    def test_unity_gain_passes_through(self):
+        gain = audio.GainStage(0)
+        self.assertIs(gain.apply(self.samples), self.samples)
+
+    def test_matches_float_scaling(self):
+        for dB in [-30, -6, 3, 10]:
+            scaled = audio.GainStage(dB).apply(self.samples)
+            reference = np.clip(self.samples * 10 ** (dB / 20), -32768, 32767).astype(np.int16)
+            self.assertEqual(scaled.dtype, np.int16)
+            # the float version truncates, the fixed point version rounds
+            self.assertLessEqual(np.max(np.abs(scaled.astype(np.int32) - reference)), 2)
+
+    def test_saturation_is_counted(self):
+        gain = audio.GainStage(20)
+        samples = np.array([100, 20000, -20000, -100], dtype=np.int16)
+        self.assertEqual(list(gain.apply(samples)), [1000, 32767, -32768, -1000])
+        self.assertEqual(gain.statistics['clipped_samples'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
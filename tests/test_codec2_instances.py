@@ -0,0 +1,93 @@
+import sys
+sys.path.append('freedata_server')
+
+import unittest
+import codec2
+
+
+class TestInstanceManager(unittest.TestCase):
+
+    def setUp(self):
+        self.instances = codec2.instance_manager()
+        self.mode = codec2.FREEDV_MODE.datac4.value
+
+    def test_instances_are_shared_per_role(self):
+        tx = self.instances.get(self.mode, "tx")
+        self.assertEqual(self.instances.get(self.mode, "tx").value, tx.value)
+        self.assertNotEqual(self.instances.get(self.mode, "rx").value, tx.value)
+        self.assertEqual(self.instances.statistics['instances'], 2)
+        self.assertEqual(self.instances.statistics['opened'], 2)
+
+    def test_close_idle(self):
+        self.instances.get(self.mode, "tx")
+        self.instances.get(self.mode, "rx")
+        self.instances.release(self.mode, "tx")
+        # instances in use are never closed
+        self.assertEqual(self.instances.close_idle(0.000001), 1)
+        self.assertEqual(self.instances.statistics['instances'], 1)
+        self.assertEqual(self.instances.statistics['closed'], 1)
+
+    def test_zero_timeout_keeps_instances(self):
+        self.instances.get(self.mode, "tx")
+        self.instances.release(self.mode, "tx")
+        self.assertEqual(self.instances.close_idle(0), 0)
+        self.assertEqual(self.instances.statistics['instances'], 1)
+
+    def test_reopen_after_close(self):
+        self.instances.get(self.mode, "tx")
+        self.instances.release(self.mode, "tx")
+        self.instances.close_idle(0.000001)
+        freedv = self.instances.get(self.mode, "tx")
+        self.assertEqual(codec2.api.freedv_get_bits_per_modem_frame(freedv) // 8, codec2.get_bytes_per_frame(self.mode))
+        self.assertEqual(self.instances.statistics['opened'], 2)
+
+    def test_memory_estimate(self):
+        self.instances.get(self.mode, "tx")
+        expected = codec2.estimate_instance_memory(codec2.mode_geometry(self.mode))
+        self.assertGreater(expected, 0)
+        self.assertEqual(self.instances.statistics['memory_estimate'], expected)
+        self.instances.get(self.mode, "rx")
+        self.assertEqual(self.instances.statistics['memory_estimate'], 2 * expected)
+
+    def test_close_unused(self):
+        self.instances.get(self.mode, "tx")
+        self.instances.get(self.mode, "rx")
+        self.instances.release(self.mode, "tx")
+        self.instances.close_unused(self.mode)
+        self.assertEqual(self.instances.statistics['instances'], 1)
+        self.assertEqual(self.instances.statistics['closed'], 1)
+
+
+class TestModeGeometry(unittest.TestCase):
+
+    def test_matches_codec2(self):
+        for mode in codec2.FREEDV_MODE:
+            geometry = codec2.mode_geometry(mode.value)
+            freedv = codec2.open_instance(mode.value)
+            self.assertEqual(geometry['bytes_per_frame'], codec2.api.freedv_get_bits_per_modem_frame(freedv) // 8)
+            self.assertEqual(geometry['payload_bytes_per_frame'], geometry['bytes_per_frame'] - 2)
+            self.assertEqual(geometry['n_tx_modem_samples'], codec2.api.freedv_get_n_tx_modem_samples(freedv))
+            self.assertEqual(geometry['n_max_modem_samples'], codec2.api.freedv_get_n_max_modem_samples(freedv))
+            codec2.api.freedv_close(freedv)
+
+    def test_cached(self):
+        mode = codec2.FREEDV_MODE.datac1.value
+        self.assertIs(codec2.mode_geometry(mode), codec2.mode_geometry(mode))
+
+
+class TestScatterPoints(unittest.TestCase):
+
+    def test_points(self):
+        modem_stats = codec2.MODEMSTATS()
+        modem_stats.rx_symbols[0][0] = 2500
+        modem_stats.rx_symbols[0][1] = -1500
+        # points on an axis are skipped
+        modem_stats.rx_symbols[1][2] = 3000
+        modem_stats.rx_symbols[3][4] = -999
+        modem_stats.rx_symbols[3][5] = 999
+        points = codec2.get_scatter_points(modem_stats)
+        self.assertEqual(points.tolist(), [[2, -2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import sys
 sys.path.append('freedata_server')
 import unittest
+import os
+import tempfile
 import config
 
 class TestConfigMethods(unittest.TestCase):
@@ -48,6 +50,21 @@ class TestConfigMethods(unittest.TestCase):
 
         data = {'STATION': {'ssid_list': [1, 2, 3]}}
         self.assertIsNone(self.config.validate_data(data))
+
+    def test_missing_setting_defaults(self):
+        # a config file written before the setting existed
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'config.ini')
+            with open(path, 'w') as configfile:
+                configfile.write("[MODEM]\ntx_delay = 50\n")
+            data = config.CONFIG(path).read()
+        self.assertEqual(data['MODEM']['tx_burst_cache_mb'], 16)
+        self.assertEqual(data['MODEM']['fft_max_rate'], 10)
+        self.assertEqual(data['GUI']['event_queue_size'], 256)
+        self.assertEqual(data['GUI']['event_retention'], [])
+        self.assertEqual(data['MODEM']['codec2_instance_idle_timeout'], 60)
+        self.assertEqual(data['MODEM']['tx_delay'], 50)
+        self.assertEqual(data['MODEM']['demodulator_processes'], 0)
         
 
 if __name__ == '__main__':
@@ -7,6 +7,7 @@ from data_frame_factory import DataFrameFactory
 from codec2 import FREEDV_MODE
 import helpers
 from modem_frametypes import FRAME_TYPE
+from frame_buffer import FrameBufferPool
 
 class TestDataFrameFactory(unittest.TestCase):
 
@@ -64,5 +65,17 @@ class TestDataFrameFactory(unittest.TestCase):
         avail = self.factory.get_available_data_payload_for_mode(FRAME_TYPE.ARQ_BURST_FRAME, FREEDV_MODE.datac3)
         self.assertEqual(avail, 119) # 128 bytes datac3 frame payload - BURST frame overhead
 
+    def testDeconstructPooledBuffer(self):
+        pool = FrameBufferPool(128, count=1)
+        frame_buffer = pool.acquire()
+        frame = self.factory.build_arq_burst_frame(FREEDV_MODE.datac3, 123, 40, b'Hello World!', 0)
+        frame_buffer.storage[:len(frame)] = frame
+        frame_data = self.factory.deconstruct(frame_buffer.payload[:len(frame)])
+        # the buffer gets reused after dispatching
+        frame_buffer.release()
+        pool.acquire().storage[:] = bytes(128)
+        self.assertEqual(frame_data['session_id'], 123)
+        self.assertEqual(frame_data['data'][:12], b'Hello World!')
+
 if __name__ == '__main__':
     unittest.main()
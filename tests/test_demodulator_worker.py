@@ -0,0 +1,88 @@
+import sys
+sys.path.append('freedata_server')
+
+import queue
+import time
+import unittest
+import numpy as np
+import codec2
+import demodulator_worker
+import modulator
+
+
+class TestDrainOverflow(unittest.TestCase):
+
+    def test_overflow_while_draining(self):
+        history = codec2.shared_ring_buffer(100)
+        reader = history.reader(50)
+        statistics = {'overflows': 0}
+        nin = 10
+        history.push(np.arange(40, dtype=np.int16))
+
+        reported = []
+        while reader.nbuffer >= nin:
+            reported.append(demodulator_worker.check_overflow(reader, statistics))
+            if len(reported) == 2:
+                # the writer laps the reader while it is decoding
+                history.push(np.arange(60, dtype=np.int16))
+                history.push(np.arange(60, dtype=np.int16))
+            reader.pop(nin)
+
+        self.assertEqual(reported.count(True), 1)
+        self.assertEqual(statistics['overflows'], 1)
+        self.assertLessEqual(reader.nbuffer, reader.size)
+
+    def test_no_overflow(self):
+        history = codec2.shared_ring_buffer(100)
+        reader = history.reader(50)
+        statistics = {'overflows': 0}
+        history.push(np.arange(40, dtype=np.int16))
+        self.assertFalse(demodulator_worker.check_overflow(reader, statistics))
+        self.assertEqual(statistics['overflows'], 0)
+
+
+
+class TestDemodulatorProcessPool(unittest.TestCase):
+
+    def setUp(self):
+        self.mode = codec2.FREEDV_MODE.signalling
+        self.history = codec2.shared_memory_ring_buffer(2 * 9600)
+        self.pool = demodulator_worker.DemodulatorProcessPool([self.mode.value], 1, self.history, 9600)
+        self.pool.set_decode(self.mode.value, True)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.stop()
+        self.history.close(unlink=True)
+
+    def get_result(self, kind, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                result_kind, data = self.pool.results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if result_kind == kind:
+                return data
+        self.fail(f"no {kind} from the worker")
+
+    def test_decode_burst(self):
+        # the decoder is running, once the worker reports statistics
+        self.get_result('statistics')
+
+        payload = bytes([7]) * codec2.mode_geometry(self.mode.value)['payload_bytes_per_frame']
+        burst = modulator.Modulator({'MODEM': {'tx_delay': 50}}).create_burst(self.mode, 1, 200, [payload])
+        samples = np.concatenate([burst, np.zeros(8000, dtype=np.int16)])
+        for i in range(0, len(samples), 800):
+            self.history.push(samples[i:i + 800])
+            self.pool.notify()
+            time.sleep(0.02)
+
+        frame = self.get_result('frame')
+        self.assertEqual(frame['mode_name'], 'SIGNALLING')
+        self.assertEqual(frame['payload'][:len(payload)], payload)
+        self.assertGreater(len(frame['scatter']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import sys
+sys.path.append('freedata_server')
+
+import queue
+import unittest
+from event_manager import EventManager, EventQueue, classify_event, parse_retention
+
+
+def progress(session_id, received_bytes):
+    return {"type": "arq", "arq-transfer-inbound": {
+        'session_id': session_id, 'received_bytes': received_bytes, 'total_bytes': 100}}
+
+
+def finished(session_id):
+    return {"type": "arq", "arq-transfer-inbound": {'session_id': session_id, 'success': True}}
+
+
+class TestEventQueue(unittest.TestCase):
+
+    def test_classify(self):
+        self.assertEqual(classify_event(progress(1, 10))[:2], ('arq', 'arq-progress'))
+        self.assertEqual(classify_event(finished(1))[:2], ('arq', 'arq'))
+        self.assertEqual(classify_event({"ptt": True})[0], 'ptt')
+        self.assertEqual(classify_event({"message-db": "changed"})[0], 'message-db')
+        self.assertEqual(classify_event([1, 2, 3])[0], 'fft')
+
+    def test_progress_is_coalesced(self):
+        events = EventQueue()
+        for received_bytes in range(10):
+            events.put(progress(1, received_bytes))
+        events.put(progress(2, 5))
+        self.assertEqual(events.qsize(), 2)
+        self.assertEqual(events.get_nowait()["arq-transfer-inbound"]['received_bytes'], 9)
+        self.assertEqual(events.statistics['coalesced'], 9)
+
+    def test_finished_is_never_dropped(self):
+        events = EventQueue(maxsize=4)
+        events.put(finished(1))
+        events.put({"message-db": "changed", "message_id": 1})
+        for n in range(20):
+            events.put({"type": "frame-handler", "received": n})
+        received = [events.get_nowait() for _ in range(events.qsize())]
+        self.assertEqual(received[0], finished(1))
+        self.assertEqual(received[1]["message-db"], "changed")
+        self.assertEqual(len(received), 4)
+        self.assertEqual(events.statistics['dropped'], 18)
+        with self.assertRaises(queue.Empty):
+            events.get(timeout=0.01)
+
+    def test_topics(self):
+        events = EventQueue(topics=['ptt'])
+        manager = EventManager([events])
+        manager.send_ptt_change(True)
+        manager.freedata_message_db_change()
+        self.assertEqual(events.get_nowait(), {"ptt": True})
+        self.assertTrue(events.empty())
+
+    def test_configurable_retention(self):
+        events = EventQueue(retention={'arq-progress': 'never-drop'})
+        events.put(progress(1, 1))
+        events.put(progress(1, 2))
+        self.assertEqual(events.qsize(), 2)
+
+    def test_parse_retention(self):
+        retention = parse_retention(["arq-progress: never-drop", "frame-handler:coalesce", "ptt:keep", "unknown:coalesce"])
+        self.assertEqual(retention, {'arq-progress': 'never-drop', 'frame-handler': 'coalesce'})
+        events = EventQueue(retention=retention)
+        events.put(progress(1, 1))
+        events.put(progress(1, 2))
+        self.assertEqual(events.qsize(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
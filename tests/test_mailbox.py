@@ -0,0 +1,50 @@
+import sys
+sys.path.append('freedata_server')
+
+import queue
+import threading
+import time
+import unittest
+from queues import LatestValueMailbox
+
+
+class TestLatestValueMailbox(unittest.TestCase):
+
+    def test_overwrite(self):
+        mailbox = LatestValueMailbox()
+        for value in range(5):
+            mailbox.put(value)
+        self.assertEqual(mailbox.qsize(), 1)
+        self.assertEqual(mailbox.get(timeout=1), 4)
+        self.assertTrue(mailbox.empty())
+        self.assertEqual(mailbox.statistics, {'published': 1, 'dropped': 4})
+
+    def test_get_timeout(self):
+        mailbox = LatestValueMailbox()
+        with self.assertRaises(queue.Empty):
+            mailbox.get(timeout=0.05)
+        with self.assertRaises(queue.Empty):
+            mailbox.get_nowait()
+
+    def test_get_waits_for_put(self):
+        mailbox = LatestValueMailbox()
+        threading.Timer(0.05, mailbox.put, args=["spectrum"]).start()
+        self.assertEqual(mailbox.get(timeout=1), "spectrum")
+
+    def test_max_rate(self):
+        mailbox = LatestValueMailbox(max_rate=10)
+        mailbox.put(1)
+        mailbox.get(timeout=1)
+        mailbox.put(2)
+        start = time.monotonic()
+        self.assertEqual(mailbox.get(timeout=1), 2)
+        self.assertGreaterEqual(time.monotonic() - start, 0.08)
+        # the value stays in the mailbox, if the interval doesn't fit into the timeout
+        mailbox.put(3)
+        with self.assertRaises(queue.Empty):
+            mailbox.get(timeout=0.01)
+        self.assertFalse(mailbox.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
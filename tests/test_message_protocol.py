@@ -34,13 +34,7 @@ class TestModem:
         self.states = StateManager(state_q)
 
     def getFrameTransmissionTime(self, mode):
-        samples = 0
-        c2instance = codec2.open_instance(mode.value)
-        samples += codec2.api.freedv_get_n_tx_preamble_modem_samples(c2instance)
-        samples += codec2.api.freedv_get_n_tx_modem_samples(c2instance)
-        samples += codec2.api.freedv_get_n_tx_postamble_modem_samples(c2instance)
-        time = samples / 8000
-        return time
+        return codec2.mode_geometry(mode.value)['duration']
 
     def transmit(self, mode, repeats: int, repeat_delay: int, frames: bytearray) -> bool:
         # Simulate transmission time
@@ -0,0 +1,149 @@
+import sys
+sys.path.append('freedata_server')
+
+import unittest
+from unittest import mock
+import numpy as np
+import audio
+import codec2
+import modulator
+
+
+class TestOutputBurst(unittest.TestCase):
+
+    def setUp(self):
+        self.modulator = modulator.Modulator({'MODEM': {'tx_delay': 50}})
+        self.gain = audio.GainStage(-3)
+
+    def frames(self, mode):
+        payload = codec2.mode_geometry(mode.value)['payload_bytes_per_frame']
+        return [bytes([i + 1]) * payload for i in range(2)]
+
+    def write_output_burst(self, mode, repeats, repeat_delay, frames, sample_rate=48000):
+        burst, _ = self.modulator.allocate_output_burst(mode, repeats, repeat_delay, frames, sample_rate)
+        for _ in self.modulator.write_output_burst(
+                burst, mode, repeats, repeat_delay, frames, self.gain, sample_rate, codec2.streaming_resampler(2400)
+        ):
+            pass
+        return burst
+
+    def test_same_as_resampling_the_burst(self):
+        for mode in [codec2.FREEDV_MODE.signalling, codec2.FREEDV_MODE.datac4]:
+            frames = self.frames(mode)
+            # each burst leaves the TX filter of the instance in the same state
+            self.modulator.create_burst(mode, 2, 100, frames)
+            burst = self.gain.apply(self.modulator.create_burst(mode, 2, 100, frames))
+            expected = codec2.streaming_resampler(len(burst) * 6).resample8_to_48(burst)
+            output = self.write_output_burst(mode, 2, 100, frames)
+            np.testing.assert_array_equal(output, expected)
+
+    def test_streamed_burst(self):
+        mode = codec2.FREEDV_MODE.datac4
+        frames = self.frames(mode)
+        expected = self.write_output_burst(mode, 2, 100, frames)
+        self.modulator.create_burst(mode, 2, 100, frames)
+        expected8 = self.gain.apply(self.modulator.create_burst(mode, 2, 100, frames))
+        chunks = list(self.modulator.stream_output_burst(
+            mode, 2, 100, frames, self.gain, 48000, codec2.streaming_resampler(2400)
+        ))
+        # tx delay, the frames and the repeat delays
+        self.assertEqual(len(chunks), 1 + 2 * (2 + 1))
+        np.testing.assert_array_equal(np.concatenate([chunk for chunk, _ in chunks]), expected)
+        np.testing.assert_array_equal(np.concatenate([chunk8 for _, chunk8 in chunks]), expected8)
+        # the complete burst is cached
+        cached = list(self.modulator.stream_output_burst(
+            mode, 2, 100, frames, self.gain, 48000, codec2.streaming_resampler(2400)
+        ))
+        self.assertEqual(len(cached), 1)
+        np.testing.assert_array_equal(cached[0][0], expected)
+        np.testing.assert_array_equal(cached[0][1], expected8)
+
+    def test_8k_output(self):
+        mode = codec2.FREEDV_MODE.datac4
+        frames = self.frames(mode)
+        self.modulator.create_burst(mode, 1, 0, frames)
+        expected = self.gain.apply(self.modulator.create_burst(mode, 1, 0, frames))
+        output = self.write_output_burst(mode, 1, 0, frames, 8000)
+        np.testing.assert_array_equal(output, expected)
+
+    def test_waveform_cache(self):
+        mode = codec2.FREEDV_MODE.datac4
+        cache = self.modulator.waveform_cache
+        geometry = codec2.mode_geometry(mode.value)
+        preamble = self.modulator.piece_cache.get_preamble(mode, geometry)
+        _, postamble = self.modulator.piece_cache.get_frame(mode, self.frames(mode)[0], geometry)
+        cache.get(mode, self.gain, 48000, preamble, postamble)
+        cache.get(mode, self.gain, 48000, preamble, postamble)
+        self.assertEqual(cache.statistics, {'hits': 1, 'misses': 1})
+        # a new gain is a new waveform
+        cache.get(mode, audio.GainStage(0), 48000, preamble, postamble)
+        self.assertEqual(cache.statistics['misses'], 2)
+
+        codec2.set_ofdm_configuration(
+            codec2.FREEDV_MODE.data_ofdm_500.value,
+            codec2.ofdm_configurations[codec2.FREEDV_MODE.data_ofdm_500.value]
+        )
+        cache.get(mode, self.gain, 48000, preamble, postamble)
+        self.assertEqual(cache.statistics['misses'], 3)
+
+    def test_piece_cache(self):
+        mode = codec2.FREEDV_MODE.datac4
+        frames = self.frames(mode)
+        uncached = self.write_output_burst(mode, 2, 100, frames)
+        # the repeat is modulated once
+        self.assertEqual(self.modulator.piece_cache.statistics['misses'], 2)
+        self.assertEqual(self.modulator.piece_cache.statistics['hits'], 2)
+        # cached pieces are copied without modulating on the live instance
+        with mock.patch.object(codec2.api, "freedv_rawdatapreambletx") as preamble, \
+                mock.patch.object(codec2.api, "freedv_rawdatatx") as frame, \
+                mock.patch.object(codec2.api, "freedv_rawdatapostambletx") as postamble:
+            cached = self.write_output_burst(mode, 2, 100, frames)
+        preamble.assert_not_called()
+        frame.assert_not_called()
+        postamble.assert_not_called()
+        np.testing.assert_array_equal(cached, uncached)
+        self.assertEqual(self.modulator.piece_cache.statistics['hits'], 6)
+
+        # the same as modulating the frames one after the other
+        self.modulator.create_burst(mode, 2, 100, frames)
+        burst = self.gain.apply(self.modulator.create_burst(mode, 2, 100, frames))
+        expected = codec2.streaming_resampler(len(burst) * 6).resample8_to_48(burst)
+        np.testing.assert_array_equal(cached, expected)
+
+
+class TestBurstCache(unittest.TestCase):
+
+    def test_repeated_burst_is_cached(self):
+        mod = modulator.Modulator({'MODEM': {'tx_delay': 50}})
+        gain = audio.GainStage(0)
+        mode = codec2.FREEDV_MODE.signalling
+        frame = bytearray(codec2.mode_geometry(mode.value)['payload_bytes_per_frame'])
+        first = mod.get_output_burst(mode, 1, 0, frame, gain, 48000, codec2.streaming_resampler(2400))
+        again = mod.get_output_burst(mode, 1, 0, frame, gain, 48000, codec2.streaming_resampler(2400))
+        self.assertIs(first, again)
+        self.assertFalse(again.flags.writeable)
+        self.assertEqual(mod.burst_cache.statistics['hits'], 1)
+        # other bytes are another burst
+        frame[0] = 1
+        mod.get_output_burst(mode, 1, 0, frame, gain, 48000, codec2.streaming_resampler(2400))
+        self.assertEqual(mod.burst_cache.statistics['misses'], 2)
+
+    def test_bounded_size(self):
+        cache = modulator.BurstCache(3000)
+        for i in range(3):
+            cache.put(i, np.zeros(500, dtype=np.int16))
+        cache.get(0)
+        cache.put(3, np.zeros(500, dtype=np.int16))
+        # the least recently used burst is evicted
+        self.assertIsNone(cache.get(1))
+        self.assertIsNotNone(cache.get(0))
+        self.assertEqual(cache.statistics['bytes'], 3000)
+        self.assertEqual(cache.statistics['evicted'], 1)
+        # bursts larger than the cache are not kept
+        cache.put(4, np.zeros(2000, dtype=np.int16))
+        self.assertIsNone(cache.get(4))
+        self.assertEqual(cache.statistics['entries'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
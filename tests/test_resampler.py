@@ -0,0 +1,75 @@
+import sys
+sys.path.append('freedata_server')
+
+import time
+import unittest
+import numpy as np
+import codec2
+
+
+def calls_per_second(function, duration=0.3):
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        function()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+class TestStreamingResampler(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.audio_48k = rng.integers(-10000, 10000, 4800, dtype=np.int16)
+        self.audio_8k = rng.integers(-10000, 10000, 800, dtype=np.int16)
+
+    def test_first_block_matches_resampler(self):
+        # both are starting with empty filter memory
+        np.testing.assert_array_equal(
+            codec2.streaming_resampler().resample48_to_8(self.audio_48k),
+            codec2.resampler().resample48_to_8(self.audio_48k),
+        )
+        np.testing.assert_array_equal(
+            codec2.streaming_resampler().resample8_to_48(self.audio_8k),
+            codec2.resampler().resample8_to_48(self.audio_8k),
+        )
+
+    def test_blocks_match_single_call(self):
+        audio = np.tile(self.audio_48k, 10)
+        blockwise = codec2.streaming_resampler(4800)
+        blocks = [blockwise.resample48_to_8(audio[i:i + 4800]) for i in range(0, len(audio), 4800)]
+        # the working buffers are growing for this one
+        single = codec2.streaming_resampler(4800).resample48_to_8(audio)
+        np.testing.assert_array_equal(np.concatenate(blocks), single)
+
+    def test_output_into_caller_array(self):
+        resampler = codec2.streaming_resampler(4800)
+        out8 = np.zeros(800, dtype=np.int16)
+        result = resampler.resample48_to_8(self.audio_48k, out8)
+        self.assertIs(result, out8)
+        self.assertTrue(np.any(out8))
+
+        out48 = np.zeros(4800, dtype=np.int16)
+        self.assertIs(resampler.resample8_to_48(self.audio_8k, out48), out48)
+
+    def test_benchmark(self):
+        reference = codec2.resampler()
+        streaming = codec2.streaming_resampler(4800)
+        out8 = np.empty(800, dtype=np.int16)
+        out48 = np.empty(4800, dtype=np.int16)
+
+        results = {
+            '48_to_8': (calls_per_second(lambda: reference.resample48_to_8(self.audio_48k)),
+                        calls_per_second(lambda: streaming.resample48_to_8(self.audio_48k, out8))),
+            '8_to_48': (calls_per_second(lambda: reference.resample8_to_48(self.audio_8k)),
+                        calls_per_second(lambda: streaming.resample8_to_48(self.audio_8k, out48))),
+        }
+        for name, (reference_rate, streaming_rate) in results.items():
+            print(f"resample {name}: resampler {reference_rate:.0f} calls/s, "
+                  f"streaming_resampler {streaming_rate:.0f} calls/s")
+            # generous margin, this is not a quiet benchmark machine
+            self.assertGreater(streaming_rate, reference_rate * 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
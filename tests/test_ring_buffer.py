@@ -0,0 +1,120 @@
+import sys
+sys.path.append('freedata_server')
+
+import unittest
+import numpy as np
+import codec2
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def test_push_pop(self):
+        buffer = codec2.ring_buffer(10)
+        buffer.push(np.arange(6, dtype=np.int16))
+        self.assertEqual(buffer.nbuffer, 6)
+        buffer.pop(4)
+        self.assertEqual(buffer.nbuffer, 2)
+        self.assertEqual(list(buffer.buffer[:2]), [4, 5])
+
+    def test_contiguous_view_after_wrap(self):
+        buffer = codec2.ring_buffer(10)
+        buffer.push(np.arange(8, dtype=np.int16))
+        buffer.pop(7)
+        # this push wraps around the end of the buffer
+        buffer.push(np.arange(8, 14, dtype=np.int16))
+        self.assertEqual(buffer.nbuffer, 7)
+        self.assertEqual(list(buffer.buffer[:buffer.nbuffer]), list(range(7, 14)))
+
+    def test_latest(self):
+        buffer = codec2.shared_ring_buffer(10)
+        self.assertEqual(len(buffer.latest(4)), 0)
+        buffer.push(np.arange(8, dtype=np.int16))
+        buffer.push(np.arange(8, 14, dtype=np.int16))
+        # the latest samples are wrapping around the end of the buffer
+        self.assertEqual(list(buffer.latest(6)), list(range(8, 14)))
+        self.assertEqual(len(buffer.latest(20)), 10)
+
+    def test_matches_audio_buffer(self):
+        rng = np.random.default_rng(42)
+        ring = codec2.ring_buffer(4800)
+        reference = codec2.audio_buffer(4800)
+        for _ in range(200):
+            samples = rng.integers(-32768, 32767, 800, dtype=np.int16)
+            if reference.nbuffer + len(samples) <= reference.size:
+                ring.push(samples)
+                reference.push(samples)
+            nin = int(rng.integers(500, 1200))
+            if reference.nbuffer >= nin:
+                np.testing.assert_array_equal(ring.buffer[:nin], reference.buffer[:nin])
+                ring.pop(nin)
+                reference.pop(nin)
+            self.assertEqual(ring.nbuffer, reference.nbuffer)
+
+    def test_overflow(self):
+        buffer = codec2.ring_buffer(10)
+        buffer.push(np.zeros(8, dtype=np.int16))
+        with self.assertRaises(AssertionError):
+            buffer.push(np.zeros(3, dtype=np.int16))
+
+
+class TestSharedRingBuffer(unittest.TestCase):
+
+    def test_readers_consume_independently(self):
+        history = codec2.shared_ring_buffer(20)
+        fast = history.reader(10)
+        slow = history.reader(10)
+        history.push(np.arange(8, dtype=np.int16))
+        fast.pop(6)
+        slow.pop(2)
+        history.push(np.arange(8, 16, dtype=np.int16))
+        self.assertEqual(list(fast.buffer[:fast.nbuffer]), list(range(6, 16)))
+        self.assertEqual(list(slow.buffer[:slow.nbuffer]), list(range(2, 16)))
+
+    def test_lagging_reader_skips_ahead(self):
+        history = codec2.shared_ring_buffer(20)
+        reader = history.reader(10)
+        history.push(np.arange(8, dtype=np.int16))
+        self.assertFalse(reader.check_overflow())
+        history.push(np.arange(8, 16, dtype=np.int16))
+        self.assertTrue(reader.check_overflow())
+        self.assertEqual(reader.overflows, 1)
+        self.assertEqual(reader.nbuffer, 5)
+        self.assertEqual(list(reader.buffer[:reader.nbuffer]), list(range(11, 16)))
+
+    def test_reader_lapped_between_pops(self):
+        history = codec2.shared_ring_buffer(20)
+        reader = history.reader(10)
+        history.push(np.arange(8, dtype=np.int16))
+        reader.pop(4)
+        # the writer laps the reader before its next pop
+        history.push(np.arange(8, 20, dtype=np.int16))
+        history.push(np.arange(20, 32, dtype=np.int16))
+        reader.pop(4)
+        self.assertEqual(reader.overflows, 1)
+        self.assertEqual(reader.nbuffer, 5)
+        self.assertEqual(list(reader.buffer[:reader.nbuffer]), list(range(27, 32)))
+
+    def test_sync(self):
+        history = codec2.shared_ring_buffer(20)
+        reader = history.reader(10)
+        history.push(np.arange(8, dtype=np.int16))
+        reader.sync()
+        self.assertEqual(reader.nbuffer, 0)
+
+
+class TestSharedMemoryRingBuffer(unittest.TestCase):
+
+    def test_attached_reader_sees_samples(self):
+        history = codec2.shared_memory_ring_buffer(20)
+        attached = codec2.shared_memory_ring_buffer(20, name=history.name)
+        reader = attached.reader(10)
+        history.push(np.arange(8, dtype=np.int16))
+        self.assertEqual(reader.nbuffer, 8)
+        self.assertEqual(list(reader.buffer[:reader.nbuffer]), list(range(8)))
+        del reader
+        attached.close()
+        history.close(unlink=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
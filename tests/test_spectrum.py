@@ -0,0 +1,72 @@
+import sys
+sys.path.append('freedata_server')
+
+import queue
+import unittest
+import numpy as np
+import audio
+import queues
+
+
+class TestStates:
+    def __init__(self):
+        self.values = {}
+        self.slots = None
+        self.busy = False
+
+    def isTransmitting(self):
+        return False
+
+    def is_receiving_codec2_signal(self):
+        return False
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def set_channel_slot_busy(self, slots):
+        self.slots = slots
+
+    def set_channel_busy_condition_traffic(self, busy):
+        self.busy = busy
+
+
+class TestSpectrumEngine(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.noise = rng.normal(0, 100, 800)
+        t = np.arange(800) / 8000
+        self.tone = (self.noise + 8000 * np.sin(2 * np.pi * 1500 * t)).astype(np.int16)
+
+    def test_slot_edges(self):
+        engine = audio.SpectrumEngine()
+        self.assertEqual(list(engine.slot_edges), [0, 65, 120, 176, 231])
+
+    def test_busy_slot(self):
+        engine = audio.SpectrumEngine()
+        states = TestStates()
+        engine.process(self.tone, queue.Queue(), states)
+        # 1500 Hz is in the center slot
+        self.assertEqual(states.slots, [False, False, True, False, False])
+        self.assertTrue(states.busy)
+
+    def test_newest_frame(self):
+        engine = audio.SpectrumEngine()
+        states = TestStates()
+        fft_queue = queues.LatestValueMailbox()
+        for _ in range(4):
+            engine.process(self.tone, fft_queue, states)
+        self.assertEqual(fft_queue.qsize(), 1)
+        # the tone has gone in the newest frame
+        engine.process(self.noise.astype(np.int16), fft_queue, states)
+        frame = fft_queue.get(timeout=1)
+        self.assertEqual(len(frame), audio.SpectrumEngine.WATERFALL_BINS)
+        self.assertNotEqual(frame[150], 100)
+        self.assertEqual(fft_queue.statistics, {'published': 1, 'dropped': 4})
+
+        engine.process(self.tone, fft_queue, states)
+        self.assertEqual(fft_queue.get(timeout=1)[150], 100)
+        self.assertEqual(fft_queue.statistics, {'published': 2, 'dropped': 4})
+
+if __name__ == '__main__':
+    unittest.main()
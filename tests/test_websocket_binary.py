@@ -0,0 +1,31 @@
+import sys
+sys.path.append('freedata_server')
+
+import unittest
+import numpy as np
+import websocket_manager
+
+
+class TestBinaryEncoding(unittest.TestCase):
+
+    def test_fft(self):
+        frame = websocket_manager.encode_binary([0, 12, 100, 300, -5])
+        frame_type, _, count = websocket_manager.BINARY_HEADER.unpack_from(frame)
+        self.assertEqual((frame_type, count), (websocket_manager.BINARY_FFT, 5))
+        values = np.frombuffer(frame, dtype=np.uint8, offset=websocket_manager.BINARY_HEADER.size)
+        self.assertEqual(list(values), [0, 12, 100, 255, 0])
+
+    def test_scatter(self):
+        frame = websocket_manager.encode_binary({"scatter": [1, -2, 300, -400]})
+        frame_type, _, count = websocket_manager.BINARY_HEADER.unpack_from(frame)
+        self.assertEqual((frame_type, count), (websocket_manager.BINARY_SCATTER, 4))
+        values = np.frombuffer(frame, dtype='<i2', offset=websocket_manager.BINARY_HEADER.size)
+        self.assertEqual(list(values), [1, -2, 300, -400])
+
+    def test_other_events_stay_json(self):
+        self.assertIsNone(websocket_manager.encode_binary({"ptt": True}))
+        self.assertIsNone(websocket_manager.encode_binary({"scatter": [], "type": "x"}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import sys
+sys.path.append('freedata_server')
+
+import asyncio
+import queue
+import threading
+import time
+import unittest
+import websocket_manager
+
+
+class FakeWebSocket:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.messages = []
+        self.closed = asyncio.Event()
+
+    async def receive_text(self):
+        await self.closed.wait()
+        raise ConnectionError("closed")
+
+    async def send_text(self, message):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.messages.append(message)
+
+    async def send_bytes(self, message):
+        self.messages.append(message)
+
+    async def close(self):
+        self.closed.set()
+
+
+class TestWebsocketFanOut(unittest.TestCase):
+
+    def run_clients(self, clients, events, client_list, pace=0.0, expected=0):
+        manager = websocket_manager.wsm()
+        event_queue = queue.Queue()
+        worker = threading.Thread(
+            target=manager.transmit_sock_data_worker, args=(client_list, event_queue), daemon=True
+        )
+
+        async def scenario():
+            connections = [
+                asyncio.create_task(manager.handle_connection(client, client_list, event_queue))
+                for client in clients
+            ]
+            await asyncio.sleep(0.05)
+            worker.start()
+            for event in events:
+                event_queue.put(event)
+                if pace:
+                    await asyncio.sleep(pace)
+            # wait until the expected number of messages has been sent to every client
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+                if expected and min(len(client.messages) for client in clients) >= expected:
+                    break
+            for client in clients:
+                await client.close()
+            await asyncio.gather(*connections)
+
+        asyncio.run(scenario())
+        manager.shutdown_flag.set()
+        worker.join(2)
+        return manager
+
+    def test_events_reach_all_clients(self):
+        clients = [FakeWebSocket() for _ in range(20)]
+        manager = self.run_clients(clients, [{"ptt": True}, {"ptt": False}], set(), expected=2)
+        for client in clients:
+            self.assertEqual(client.messages, ['{"ptt": true}', '{"ptt": false}'])
+        self.assertEqual(manager.statistics['clients'], 0)
+
+    def test_slow_client_drops_oldest(self):
+        fast = FakeWebSocket()
+        slow = FakeWebSocket(delay=10)
+        events = [{"n": n} for n in range(websocket_manager.CLIENT_QUEUE_SIZE * 2)]
+        manager = self.run_clients([fast, slow], events, set(), pace=0.001)
+        self.assertEqual(len(fast.messages), len(events))
+        self.assertGreater(manager.statistics['dropped'], 0)
+
+    def test_capacity(self):
+        clients = [FakeWebSocket() for _ in range(20)]
+        events = [{"type": "arq", "n": n} for n in range(2000)]
+        start = time.perf_counter()
+        self.run_clients(clients, events, set(), pace=0.0001, expected=len(events))
+        duration = time.perf_counter() - start
+        delivered = min(len(client.messages) for client in clients)
+        print(f"websocket fan-out: {delivered / duration:.0f} events/s to {len(clients)} clients")
+        self.assertEqual(delivered, len(events))
+
+
+if __name__ == '__main__':
+    unittest.main()